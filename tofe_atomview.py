@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set ts=4 sw=4 et sts=4 ai:
+
+"""
+Lightweight views of the atoms in a TOFE EEPROM image.
+
+The ctypes atom classes in tofe_eeprom are convenient for building images,
+but every atom is a ctypes structure with an instance dictionary and each
+field access creates new ctypes objects. An AtomView is just a reference to
+a memoryview of the whole image plus the atom's offset, with __slots__, and
+decodes fields straight from the image bytes. Use these when holding large
+numbers of parsed images in memory.
+
+>>> from tofe_eeprom import *
+>>> t = TOFEAtoms.build([
+...     AtomProductID.create("tofe.io/milkymist"),
+...     AtomProductSerial.create("MM000001"),
+...     AtomPCBRepository.create(0, "r/pcb.git"),
+...     AtomPCBLicense.create(AtomPCBLicense.Names.CC_BY_SA_v40),
+...     AtomPCBProductionBatchID.create(1450787283),
+...     AtomEEPROMTotalSize.create(0, 16*1024),
+...     AtomComment.create("Thanks for backing!"),
+...     AtomCommentOn.create(5, "16k"),
+...     AtomCompressedCommentOn.create(5, "Enable the LED"),
+... ])
+>>> for v in views(t.as_bytearray()):
+...     print(v)
+AtomProductID('https://tofe.io/milkymist')
+AtomProductSerial('MM000001')
+AtomPCBRepository(0, 'r/pcb.git')
+AtomPCBLicense(CC BY SA, 4.0)
+AtomPCBProductionBatchID(1450787283)
+AtomEEPROMTotalSize(0x0, 0x4000)
+AtomComment('Thanks for backing!')
+AtomCommentOn(5, '16k')
+AtomCompressedCommentOn(5, 'Enable the LED')
+>>> [v.value for v in views(t.as_bytearray())][2:6]
+[(0, 'r/pcb.git'), <Names.CC_BY_SA_v40: 69>, 1450787283, (0, 16384)]
+>>> hasattr(views(t.as_bytearray())[0], '__dict__')
+False
+"""
+
+from tofe_eeprom import (
+    ATOMS_TYPES,
+    Atom,
+    AtomCommentOn,
+    AtomCompressedCommentOn,
+    AtomFormatBinaryBlob,
+    AtomFormatCompressedString,
+    AtomFormatExpandInt,
+    AtomFormatLicense,
+    AtomFormatRelativeURL,
+    AtomFormatSizeOffset,
+    AtomFormatString,
+    AtomFormatTimestamp,
+    AtomFormatURL,
+    TOFEAtoms,
+)
+
+
+class AtomView(object):
+    """An atom of unknown format, the payload is raw bytes.
+
+    Each view class decodes and encodes through the decode() and encode()
+    classmethods of its FORMAT class in tofe_eeprom.
+    """
+    __slots__ = ("_buf", "_offset")
+
+    FORMAT = Atom
+
+    # Bytes between the atom header and the data
+    EXTRA = 0
+
+    def __init__(self, buf, offset=0):
+        self._buf = buf
+        self._offset = offset
+
+    @property
+    def type(self):
+        return self._buf[self._offset]
+
+    @property
+    def atom_size(self):
+        return 2 + self._buf[self._offset+1]
+
+    @property
+    def data(self):
+        start = self._offset + 2 + self.EXTRA
+        return self._buf[start:self._offset+self.atom_size]
+
+    @property
+    def name(self):
+        atom_cls = ATOMS_TYPES.get(self.type)
+        if atom_cls is None:
+            return "Atom0x%02x" % self.type
+        return atom_cls.__name__
+
+    def _decode(self, format_cls):
+        return format_cls.decode(self.tobytes(), 2, self.atom_size - 2)
+
+    @property
+    def value(self):
+        return self._decode(self.FORMAT)
+
+    def tobytes(self):
+        return bytes(self._buf[self._offset:self._offset+self.atom_size])
+
+    @classmethod
+    def encode(cls, atom_type, *value):
+        """Bytes of an atom of atom_type holding value, see FORMAT.encode()."""
+        payload = cls.FORMAT.encode(*value)
+        return bytes((atom_type, len(payload))) + payload
+
+    def _repr_args(self):
+        return repr(self.value)
+
+    def __repr__(self):
+        return "%s(%s)" % (self.name, self._repr_args())
+
+
+class StringView(AtomView):
+    r"""
+    >>> StringView.encode(0xff, "numato") == AtomFormatString.create("numato").as_bytearray()
+    True
+    """
+    __slots__ = ()
+
+    FORMAT = AtomFormatString
+
+    @property
+    def str(self):
+        return self._decode(self.FORMAT)
+
+    value = str
+
+
+class CompressedStringView(StringView):
+    r"""
+    >>> s = "ADC Value (High Byte)"
+    >>> CompressedStringView.encode(0xff, s) == AtomFormatCompressedString.create(s).as_bytearray()
+    True
+    """
+    __slots__ = ()
+
+    FORMAT = AtomFormatCompressedString
+
+
+class URLView(StringView):
+    r"""
+    >>> URLView.encode(0xff, "https://numato") == AtomFormatURL.create("https://numato").as_bytearray()
+    True
+    """
+    __slots__ = ()
+
+    FORMAT = AtomFormatURL
+
+    @property
+    def str(self):
+        return self._decode(AtomFormatString)
+
+    @property
+    def url(self):
+        return self._decode(self.FORMAT)
+
+    value = url
+
+
+class RelativeURLView(StringView):
+    r"""
+    >>> a = AtomFormatRelativeURL.create(2, "numato")
+    >>> RelativeURLView.encode(0xff, 2, "numato") == a.as_bytearray()
+    True
+    """
+    __slots__ = ()
+
+    FORMAT = AtomFormatRelativeURL
+
+    EXTRA = 1
+
+    @property
+    def index(self):
+        return self._buf[self._offset+2]
+
+    @index.setter
+    def index(self, index):
+        self._buf[self._offset+2] = index
+
+    @property
+    def str(self):
+        return self.value[1]
+
+    value = AtomView.value
+
+    def _repr_args(self):
+        return "%i, %r" % self.value
+
+
+class CommentOnView(RelativeURLView):
+    __slots__ = ()
+
+    FORMAT = AtomCommentOn
+
+
+class CompressedCommentOnView(CommentOnView):
+    r"""
+    >>> a = AtomCompressedCommentOn.create(2, "LED Control")
+    >>> CompressedCommentOnView.encode(a.TYPE, 2, "LED Control") == a.as_bytearray()
+    True
+    """
+    __slots__ = ()
+
+    FORMAT = AtomCompressedCommentOn
+
+
+class ExpandIntView(AtomView):
+    r"""
+    >>> for v in (0, 2, 2**63):
+    ...     assert ExpandIntView.encode(0xff, v) == AtomFormatExpandInt.create(v).as_bytearray(), v
+    """
+    __slots__ = ()
+
+    FORMAT = AtomFormatExpandInt
+
+    @property
+    def v(self):
+        return self._decode(AtomFormatExpandInt)
+
+    def _repr_args(self):
+        return "%i" % self.value
+
+
+class TimestampView(ExpandIntView):
+    r"""
+    >>> for ts in (1421070400, 1606780801, 2**63):
+    ...     assert TimestampView.encode(0xff, ts) == AtomFormatTimestamp.create(ts).as_bytearray(), ts
+    """
+    __slots__ = ()
+
+    FORMAT = AtomFormatTimestamp
+
+    @property
+    def ts(self):
+        return self._decode(self.FORMAT)
+
+    value = ts
+
+
+class LicenseView(AtomView):
+    r"""
+    >>> n = AtomFormatLicense.Names.GPL_v2
+    >>> LicenseView.encode(0xff, n) == AtomFormatLicense.create(n).as_bytearray()
+    True
+    """
+    __slots__ = ()
+
+    FORMAT = AtomFormatLicense
+
+    Names = AtomFormatLicense.Names
+
+    @property
+    def license(self):
+        return self._decode(self.FORMAT)
+
+    @license.setter
+    def license(self, license):
+        self._buf[self._offset+2:self._offset+3] = self.FORMAT.encode(license)
+
+    value = license
+
+    def _repr_args(self):
+        return "%s, %s" % self.FORMAT.describe(self.license)
+
+
+class SizeOffsetView(AtomView):
+    r"""
+    >>> for o, s in ((5, 10), (700, 10), (2**31, 2)):
+    ...     assert SizeOffsetView.encode(0xff, o, s) == AtomFormatSizeOffset.create(o, s).as_bytearray(), (o, s)
+    """
+    __slots__ = ()
+
+    FORMAT = AtomFormatSizeOffset
+
+    @property
+    def offset(self):
+        return self.value[0]
+
+    @property
+    def size(self):
+        return self.value[1]
+
+    def _repr_args(self):
+        return "0x%x, 0x%x" % self.value
+
+
+class BinaryBlobView(AtomView):
+    r"""
+    >>> BinaryBlobView.encode(0xff, b"\0\1") == AtomFormatBinaryBlob.create(b"\0\1").as_bytearray()
+    True
+    """
+    __slots__ = ()
+
+    FORMAT = AtomFormatBinaryBlob
+
+    @property
+    def blob(self):
+        return self._decode(self.FORMAT)
+
+    value = blob
+
+
+# Format class -> view class, most specific first.
+FORMAT_VIEWS = [
+    (AtomCompressedCommentOn,       CompressedCommentOnView),
+    (AtomCommentOn,                 CommentOnView),
+    (AtomFormatRelativeURL,         RelativeURLView),
+    (AtomFormatURL,                 URLView),
+    (AtomFormatCompressedString,    CompressedStringView),
+    (AtomFormatString,              StringView),
+    (AtomFormatTimestamp,           TimestampView),
+    (AtomFormatExpandInt,           ExpandIntView),
+    (AtomFormatLicense,             LicenseView),
+    (AtomFormatSizeOffset,          SizeOffsetView),
+    (AtomFormatBinaryBlob,          BinaryBlobView),
+]
+
+
+def _view_cls(atom_cls):
+    for format_cls, view_cls in FORMAT_VIEWS:
+        if issubclass(atom_cls, format_cls):
+            return view_cls
+    return AtomView
+
+VIEWS_TYPES = dict(
+    (atom_type, _view_cls(atom_cls)) for atom_type, atom_cls in ATOMS_TYPES.items())
+
+
+def atom_view(buf, offset=0):
+    """Return the view for the atom at offset in buf."""
+    return VIEWS_TYPES.get(buf[offset], AtomView)(buf, offset)
+
+
+def iter_views(image, cls=TOFEAtoms):
+    """Yield views of the atoms in image (any bytes-like object).
+
+    The image is not validated, use TOFEAtoms.from_buffer() first for
+    untrusted data. Views of a writable buffer can change it in place.
+    """
+    buf = memoryview(image).cast('B')
+    offset = cls._data.offset
+    for i in range(0, buf[cls.atoms.offset]):
+        view = atom_view(buf, offset)
+        yield view
+        offset += 2 + buf[offset+1]
+
+
+def views(image, cls=TOFEAtoms):
+    return list(iter_views(image, cls))
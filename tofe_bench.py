@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set ts=4 sw=4 et sts=4 ai:
+
+"""
+Benchmarks for encoding, decoding, CRC and building TOFE EEPROM images.
+
+Results are written as JSON so runs on different commits can be compared.
+
+  ./tofe_bench.py -o before.json
+  ./tofe_bench.py --compare before.json
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import timeit
+
+from tofe_eeprom import *
+import tofe_board
+import tofe_cache
+import tofe_i2c
+
+try:
+    import tofe_crc8_batch
+except ImportError:
+    tofe_crc8_batch = None
+
+BENCHMARKS = []
+
+
+def bench(name):
+    """Register a benchmark, fn does the setup and returns what to time."""
+    def register(fn):
+        BENCHMARKS.append((name, fn))
+        return fn
+    return register
+
+
+def _image(n, cls=AtomComment, value="Thanks for backing!"):
+    t = TOFEAtoms()
+    for i in range(0, n):
+        t.add_atom(cls.create(value))
+    return t
+
+
+@bench("AtomFormatString.create")
+def _():
+    return lambda: AtomProductID.create("tofe.io/milkymist")
+
+
+@bench("AtomFormatExpandInt.v get")
+def _():
+    a = AtomPCBProductionBatchID.create(1450787283)
+    return lambda: a.v
+
+
+@bench("AtomFormatExpandInt.v set")
+def _():
+    a = AtomPCBProductionBatchID.create(1450787283)
+    def f():
+        a.v = 30716883
+    return f
+
+
+@bench("AtomFormatSizeOffset.create")
+def _():
+    return lambda: AtomEEPROMVendorData.create(0x600, 256)
+
+
+@bench("AtomFormatSizeOffset.offset")
+def _():
+    a = AtomEEPROMVendorData.create(0x600, 256)
+    return lambda: a.offset
+
+
+for _n in (10, 100):
+    @bench("crc_calculate %i atoms" % _n)
+    def _(n=_n):
+        return _image(n).crc_calculate
+
+    @bench("get_atom %i atoms" % _n)
+    def _(n=_n):
+        t = _image(n)
+        return lambda: t.get_atom(n-1)
+
+    @bench("repr %i atoms" % _n)
+    def _(n=_n):
+        t = _image(n)
+        return lambda: repr(t)
+
+for _n in (10, 100, 250):
+    @bench("add_atom %i atoms" % _n)
+    def _(n=_n):
+        atoms = [AtomComment.create("Thanks for backing!") for i in range(0, n)]
+        def f():
+            t = TOFEAtoms()
+            for a in atoms:
+                t.add_atom(a)
+        return f
+
+    @bench("TOFEAtoms.build %i atoms" % _n)
+    def _(n=_n):
+        atoms = [AtomComment.create("Thanks for backing!") for i in range(0, n)]
+        return lambda: TOFEAtoms.build(atoms)
+
+for _board in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "boards", "*.json"))):
+    @bench("board %s" % os.path.splitext(os.path.basename(_board))[0])
+    def _(board=tofe_board.load(_board)):
+        return lambda: tofe_board.build(board)
+
+
+def _value(atom):
+    """The value of a ctypes atom through its properties."""
+    if isinstance(atom, (AtomFormatRelativeURL, AtomCommentOn, AtomCompressedCommentOn)):
+        return (atom.index, atom.str)
+    if isinstance(atom, AtomFormatSizeOffset):
+        return (atom.offset, atom.size)
+    if isinstance(atom, AtomFormatURL):
+        return atom.url
+    if isinstance(atom, AtomFormatTimestamp):
+        return atom.ts
+    if isinstance(atom, AtomFormatExpandInt):
+        return atom.v
+    if isinstance(atom, AtomFormatLicense):
+        return atom.value
+    if isinstance(atom, AtomFormatBinaryBlob):
+        return atom.blob
+    return atom.str
+
+
+for _board in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "boards", "*.json"))):
+    _name = os.path.splitext(os.path.basename(_board))[0]
+
+    @bench("properties %s" % _name)
+    def _(image=bytes(tofe_board.build(tofe_board.load(_board)))):
+        def f():
+            t = TOFEAtoms.from_buffer(bytearray(image))
+            return [(type(a), _value(a)) for a in t.iter_atoms()]
+        assert f() == decode_image(image)
+        return f
+
+    @bench("decode_image %s" % _name)
+    def _(image=bytes(tofe_board.build(tofe_board.load(_board)))):
+        return lambda: decode_image(image)
+
+    @bench("from_buffer repr %s" % _name)
+    def _(image=bytes(tofe_board.build(tofe_board.load(_board)))):
+        return lambda: repr(TOFEAtoms.from_buffer(bytearray(image)))
+
+    @bench("ImageCache.text hit %s" % _name)
+    def _(image=bytes(tofe_board.build(tofe_board.load(_board)))):
+        cache = tofe_cache.ImageCache()
+        cache.text(image)
+        return lambda: cache.text(bytearray(image))
+
+
+def _images(n):
+    return [bytes(TOFEAtoms.build([
+        AtomProductSerial.create("MM%06i" % i),
+        AtomComment.create("Thanks for backing!"),
+    ]).as_bytearray()) for i in range(0, n)]
+
+
+@bench("crc_check 10000 images")
+def _():
+    images = _images(10000)
+    return lambda: [TOFEAtoms.from_buffer(bytearray(i), check=False).crc_check() for i in images]
+
+
+if tofe_crc8_batch is not None:
+    @bench("tofe_crc8_batch.verify 10000 images")
+    def _():
+        images = _images(10000)
+        return lambda: tofe_crc8_batch.verify(images)
+
+
+@bench("SimulatedEEPROM.read_image 16k")
+def _():
+    e = tofe_i2c.SimulatedEEPROM(16384, 64, 2)
+    e.program(TOFEAtoms.build([AtomComment.create("Thanks for backing!")] * 100))
+    return e.read_image
+
+
+@bench("SimulatedEEPROM.program 16k")
+def _():
+    def image(serial):
+        return bytes(TOFEAtoms.build(
+            [AtomProductSerial.create(serial)] + [AtomComment.create("Thanks for backing!")] * 100
+        ).as_bytearray())
+    images = [image("MM000001"), image("MM000002")]
+    e = tofe_i2c.SimulatedEEPROM(16384, 64, 2)
+    def f():
+        e.program(images[0])
+        images.reverse()
+    return f
+
+
+# Modules whose import time in a fresh interpreter is measured.
+IMPORTS = ["tofe_eeprom"]
+
+# Time allowed for importing tofe_eeprom, best of 5, checked by
+# import_time's doctest. Measured when this was set: 12-20ms, against
+# 17-33ms before the imports were made lazy. The doctest also checks the
+# deferred modules are not imported, which does not depend on timing.
+IMPORT_BUDGET = 0.025
+
+
+def _importtime(module):
+    """Import module in a new interpreter, returning -X importtime's
+    cumulative time in seconds for each module imported.
+
+    Bytecode is written and reused, so this is the cost seen by the command
+    line tools rather than that of compiling them.
+    """
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    cmd = [sys.executable, "-X", "importtime", "-c", "import " + module]
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    subprocess.run(cmd, env=env, cwd=cwd, check=True, stderr=subprocess.DEVNULL)
+    out = subprocess.run(
+        cmd, env=env, cwd=cwd, check=True, stderr=subprocess.PIPE).stderr.decode()
+    times = {}
+    for line in out.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            times[fields[2].strip()] = int(fields[1]) * 1e-6
+    return times
+
+
+def import_time(module, repeat=1):
+    """Seconds taken to import module in a new interpreter, the best of
+    repeat runs.
+
+    >>> import_time("tofe_eeprom", repeat=5) < IMPORT_BUDGET
+    True
+    >>> sorted(m for m in _importtime("tofe_eeprom") if m.split(".")[0] in (
+    ...     "crcmod", "binascii", "math", "re"))
+    []
+    """
+    return min(_importtime(module)[module] for i in range(0, repeat))
+
+
+def run(name_filter=None, repeat=5, min_time=0.2):
+    results = {}
+    for module in IMPORTS:
+        name = "import %s" % module
+        if name_filter and name_filter not in name:
+            continue
+        best = import_time(module, repeat)
+        results[name] = {"seconds": best, "number": 1}
+        print("%-35s %12.3fus" % (name, best * 1e6), file=sys.stderr)
+    for name, setup in BENCHMARKS:
+        if name_filter and name_filter not in name:
+            continue
+        timer = timeit.Timer(setup())
+        number = 1
+        while timer.timeit(number) < min_time / repeat:
+            number *= 2
+        best = min(timer.repeat(repeat, number)) / number
+        results[name] = {"seconds": best, "number": number}
+        print("%-35s %12.3fus" % (name, best * 1e6), file=sys.stderr)
+    return results
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new, threshold):
+    """Print new / old time ratios, returning the regressed benchmarks.
+
+    >>> old = {"results": {"a": {"seconds": 1.0}, "b": {"seconds": 1.0}}}
+    >>> new = {"results": {"a": {"seconds": 1.5}, "b": {"seconds": 0.5}, "c": {"seconds": 1}}}
+    >>> compare(old, new, 1.2)  # doctest: +NORMALIZE_WHITESPACE
+    a                                        1.50x  REGRESSION
+    b                                        0.50x
+    ['a']
+    """
+    regressions = []
+    for name, result in new["results"].items():
+        if name not in old["results"]:
+            continue
+        ratio = result["seconds"] / old["results"][name]["seconds"]
+        flag = ""
+        if ratio > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print("%-35s %10.2fx%s" % (name, ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("-o", "--output", help="write the results as JSON here")
+    parser.add_argument("-k", "--filter", help="only run benchmarks containing this")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--compare", metavar="JSON",
+                        help="compare against earlier results")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="slowdown ratio counted as a regression (default %(default)s)")
+    args = parser.parse_args(argv)
+
+    data = {
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": run(args.filter, args.repeat),
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+    elif not args.compare:
+        json.dump(data, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        if compare(old, data, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set ts=4 sw=4 et sts=4 ai:
+
+"""
+Compile declarative board descriptions into TOFE EEPROM images.
+
+A board is described by a JSON file with a name and a list of atoms. Each
+atom is a list of the atom name (as in tofe_eeprom.ATOMS, "Comment On" or
+"Compressed Comment On")
+followed by the arguments for its create() method. Licenses are given by
+their AtomFormatLicense.Names member name and a list of strings is joined
+with newlines.
+
+  {
+      "name": "MilkyMist",
+      "atoms": [
+          ["Manufacturer ID",     "numato.com"],
+          ["PCB Repository",      1, "r/pcb.git"],
+          ["PCB License",         "CC_BY_SA_v40"],
+          ["EEPROM Total Size",   0, 128]
+      ]
+  }
+
+Compiled images are cached by a hash of the description and of
+tofe_eeprom.py and tofe_crc8.py, so unchanged boards are not serialized
+again. Cached images are parsed, CRC included, before they are used.
+
+  ./tofe_board.py boards/milkymist.json -o milkymist_eeprom.bit
+  ./tofe_board.py boards/lowspeedio.json --c-array
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+
+import tofe_crc8
+import tofe_eeprom
+from tofe_eeprom import (
+    ATOMS,
+    AtomCommentOn,
+    AtomCompressedCommentOn,
+    AtomFormatLicense,
+    TOFEAtoms,
+)
+
+ATOMS_BY_NAME = dict(
+    (name, getattr(tofe_eeprom, "Atom" + "".join(name.split())))
+    for name, atom_format_cls in ATOMS)
+ATOMS_BY_NAME["Comment On"] = AtomCommentOn
+ATOMS_BY_NAME["Compressed Comment On"] = AtomCompressedCommentOn
+
+# Atoms with a compressed equivalent taking the same arguments.
+COMPRESSED = {
+    "Comment":      "Compressed Comment",
+    "Comment On":   "Compressed Comment On",
+}
+
+CACHE_DIR = os.environ.get(
+    "TOFE_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "tofe-eeprom"))
+
+
+def load(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def create_atom(spec):
+    """Create an atom from its description.
+
+    >>> create_atom(["PCB License", "CC_BY_SA_v40"])
+    AtomPCBLicense(CC BY SA, 4.0)
+    >>> create_atom(["Comment On", 1, ["a", "b"]])
+    AtomCommentOn(1, 'a
+    b')
+    >>> create_atom(["Serial Number", "1"])
+    Traceback (most recent call last):
+        ...
+    ValueError: Unknown atom 'Serial Number'
+    """
+    name, args = spec[0], list(spec[1:])
+    if name not in ATOMS_BY_NAME:
+        raise ValueError("Unknown atom %r" % name)
+    atom_cls = ATOMS_BY_NAME[name]
+    for i, arg in enumerate(args):
+        if isinstance(arg, list):
+            args[i] = "\n".join(arg)
+    if issubclass(atom_cls, AtomFormatLicense):
+        args = [AtomFormatLicense.Names[a] for a in args]
+    return atom_cls.create(*args)
+
+
+def build(board):
+    """Serialize a board description into image bytes."""
+    return bytes(TOFEAtoms.build(create_atom(a) for a in board["atoms"]).as_bytearray())
+
+
+def savings(board):
+    """Return (index, size, compressed size) for each atom of board with a
+    compressed equivalent, sizes include the atom header.
+
+    >>> board = {"atoms": [
+    ...     ["Product ID", "tofe.io/lowspeedio"],
+    ...     ["Comment", "Thanks for backing!"],
+    ...     ["Comment On", 0, ["LED Control", "0x800 - D5"]],
+    ... ]}
+    >>> savings(board)
+    [(1, 21, 15), (2, 25, 13)]
+    >>> len(build(board)), len(build(compress(board)))
+    (83, 65)
+    """
+    found = []
+    for i, spec in enumerate(board["atoms"]):
+        if spec[0] in COMPRESSED:
+            size = create_atom(spec)._size
+            compressed = create_atom([COMPRESSED[spec[0]]] + list(spec[1:]))._size
+            found.append((i, size, compressed))
+    return found
+
+
+def compress(board):
+    """Return a copy of board using compressed atoms where they are smaller."""
+    atoms = list(board["atoms"])
+    for i, size, compressed in savings(board):
+        if compressed < size:
+            atoms[i] = [COMPRESSED[atoms[i][0]]] + list(atoms[i][1:])
+    return dict(board, atoms=atoms)
+
+
+def _fingerprint():
+    h = hashlib.sha256()
+    for module in (tofe_eeprom, tofe_crc8):
+        with open(module.__file__, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def cache_key(board):
+    canonical = json.dumps(board, sort_keys=True, separators=(",", ":"))
+    h = hashlib.sha256(canonical.encode("utf-8"))
+    h.update(_fingerprint().encode("ascii"))
+    return h.hexdigest()
+
+
+def compile_board(board, cache_dir=CACHE_DIR):
+    """Return the image bytes for board, using the cache if possible.
+
+    >>> board = {"name": "Test", "atoms": [
+    ...     ["Manufacturer ID", "numato.com"],
+    ...     ["Product ID", "tofe.io/milkymist"],
+    ...     ["PCB Repository", 1, "r/pcb.git"],
+    ... ]}
+    >>> d = tempfile.mkdtemp()
+    >>> image = compile_board(board, d)
+    >>> TOFEAtoms.from_buffer(bytearray(image)).get_atom(2)
+    AtomPCBRepository('https://tofe.io/milkymist/r/pcb.git')
+    >>> os.listdir(d) == [cache_key(board) + ".bit"]
+    True
+    >>> compile_board(board, d) == image
+    True
+    >>> # Invalid cached images are rebuilt.
+    >>> corrupt = bytearray(image)
+    >>> corrupt[-8] ^= 1
+    >>> with open(os.path.join(d, cache_key(board) + ".bit"), "wb") as f:
+    ...     _ = f.write(corrupt)
+    >>> compile_board(board, d) == image
+    True
+    >>> with open(os.path.join(d, cache_key(board) + ".bit"), "rb") as f:
+    ...     f.read() == image
+    True
+    >>> compile_board(board, None) == image
+    True
+    """
+    if not cache_dir:
+        return build(board)
+
+    path = os.path.join(cache_dir, cache_key(board) + ".bit")
+    try:
+        with open(path, "rb") as f:
+            image = f.read()
+        TOFEAtoms.from_buffer(bytearray(image))
+        return image
+    except (FileNotFoundError, ValueError):
+        pass
+
+    image = build(board)
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=cache_dir)
+    with os.fdopen(fd, "wb") as f:
+        f.write(image)
+    os.replace(tmp, path)
+    return image
+
+
+def c_array(image, name="_veeprom_flash_data"):
+    r"""
+    >>> print(c_array(bytes(range(18))))
+    const rom uint8_t _veeprom_flash_data[] = {
+        0x00, 0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x07, 0x08, 0x09, 0x0a, 0x0b, 0x0c, 0x0d, 0x0e, 0x0f,
+        0x10, 0x11
+    };
+    """
+    lines = []
+    for i in range(0, len(image), 16):
+        lines.append(", ".join("0x%02x" % d for d in image[i:i+16]))
+    return "const rom uint8_t %s[] = {\n    %s\n};" % (name, ",\n    ".join(lines))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("board", help="board description (JSON)")
+    parser.add_argument("-o", "--output", help="write the image to this file")
+    parser.add_argument("--c-array", action="store_true",
+                        help="print the image as a C array")
+    parser.add_argument("--cache-dir", default=CACHE_DIR,
+                        help="image cache directory (default %(default)s)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always serialize the image")
+    parser.add_argument("--savings", action="store_true",
+                        help="report the space saved by compressing the comments")
+    args = parser.parse_args(argv)
+
+    board = load(args.board)
+
+    if args.savings:
+        for i, size, compressed in savings(board):
+            print("%2i %-25s %4i -> %4i bytes" % (i, board["atoms"][i][0], size, compressed))
+        size = len(build(board))
+        compressed = len(build(compress(board)))
+        print("image %i -> %i bytes (%.0f%% saved)" % (
+            size, compressed, 100.0 * (size - compressed) / size))
+        return 0
+    image = compile_board(board, None if args.no_cache else args.cache_dir)
+
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(image)
+
+    if args.c_array:
+        print("/*")
+        print(repr(TOFEAtoms.from_buffer(image)))
+        print("*/")
+        print(c_array(image))
+    elif not args.output:
+        print(board.get("name", args.board))
+        print(len(image), image)
+        print(repr(TOFEAtoms.from_buffer(image)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
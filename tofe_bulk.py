@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set ts=4 sw=4 et sts=4 ai:
+
+"""
+Bulk generation and verification of TOFE EEPROM images over many processes.
+
+Generate takes a JSON list of image specs, one per board type, for example
+
+  [{"template": "milkymist_eeprom.bit", "count": 100000, "start": 0,
+    "serial_format": "MM%06i", "batch": 1450787283, "out": "milkymist.bin"},
+   {"template": "lowspeedio_eeprom.bit", "count": 5000,
+    "serial_format": "LS%06i", "out": "lowspeedio.bin"}]
+
+and writes the images of each spec concatenated to its "out" file. Verify
+checks files of (concatenated) images and reports every invalid one.
+
+  ./tofe_bulk.py generate specs.json --jobs 8
+  ./tofe_bulk.py verify milkymist.bin lowspeedio.bin --jobs 8
+
+Work is split into chunks which are handed to a ProcessPoolExecutor, for
+verify these are ranges of about --chunk-size bytes cut at image boundaries
+so a single large file is also checked in parallel. Workers
+only return bytes and plain tuples, results are written in spec / file order
+whatever order the workers finish in.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+from tofe_eeprom import TOFEAtoms
+from tofe_provision import Provisioner
+
+# Provisioner per template, cached for the life of each worker process.
+_provisioners = {}
+
+
+def _generate(task):
+    """Worker: return (pid, elapsed, count, images) for a chunk of serials."""
+    template, serial_format, batch, start, count = task
+    t = time.time()
+    provisioner = _provisioners.get(template)
+    if provisioner is None:
+        provisioner = Provisioner(TOFEAtoms.from_file(template))
+        _provisioners[template] = provisioner
+    images = b"".join(
+        provisioner.image(serial_format % i, batch)
+        for i in range(start, start+count))
+    return os.getpid(), time.time() - t, count, images
+
+
+def _next_image(b, offset, cls=TOFEAtoms):
+    """Offset of whatever follows the image at offset in b.
+
+    That is the end of the image when its magic is right and its length
+    fits in b, otherwise the next occurrence of the magic (len(b) if there
+    is none).
+    """
+    header_size = cls._len.offset + cls._len.size
+    if b[offset:offset+len(cls.MAGIC)] == cls.MAGIC and offset + header_size <= len(b):
+        end = offset + header_size + struct.unpack_from("<I", b, offset + cls._len.offset)[0]
+        if end <= len(b):
+            return end
+    n = b.find(cls.MAGIC, offset + 1)
+    return len(b) if n < 0 else n
+
+
+def verify_buffer(b):
+    """Check the concatenated images in b.
+
+    Returns a list of (offset, error) with error None for valid images.
+    Checking carries on after an invalid image, from the end given by its
+    header if that can be trusted, or else from the next magic.
+
+    >>> from tofe_eeprom import *
+    >>> image = TOFEAtoms.build([AtomProductID.create("tofe.io/milkymist")]).as_bytearray()
+    >>> verify_buffer(image + image)
+    [(0, None), (36, None)]
+    >>> verify_buffer(image + image[:-1])
+    [(0, None), (36, 'Length 36 larger than buffer (35 bytes)')]
+    >>> bad = bytearray(image)
+    >>> bad[20] ^= 1
+    >>> verify_buffer(image + bad + b"junk" + image + image[:10])
+    [(0, None), (36, 'Invalid crc8 0x6d (calculated 0x6f)'), (72, "Invalid magic b'junkT' (expected b'TOFE\\\\x00')"), (76, None), (112, 'Buffer size too small (122 instead of at least 124 bytes)')]
+    """
+    if memoryview(b).readonly:
+        b = bytearray(b)
+    results = []
+    offset = 0
+    while offset < len(b):
+        try:
+            TOFEAtoms.from_buffer(b, offset)
+        except ValueError as e:
+            results.append((offset, str(e)))
+        else:
+            results.append((offset, None))
+        offset = _next_image(b, offset)
+    return results
+
+
+def _split(filename, chunk):
+    """Cut filename into (filename, start, end) ranges of about chunk bytes,
+    at the offsets verify_buffer() walks through."""
+    with open(filename, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return [(filename, 0, 0)]
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            ranges = []
+            start = offset = 0
+            while offset < size:
+                offset = _next_image(m, offset)
+                if offset - start >= chunk or offset == size:
+                    ranges.append((filename, start, offset))
+                    start = offset
+            return ranges
+
+
+def _verify(task):
+    """Worker: return (pid, elapsed, count, results) for a range of a file."""
+    filename, start, end = task
+    t = time.time()
+    b = bytearray(end - start)
+    with open(filename, "rb") as f:
+        f.seek(start)
+        n = f.readinto(b)
+    del b[n:]
+    results = [(start + offset, error) for offset, error in verify_buffer(b)]
+    return os.getpid(), time.time() - t, len(results), results
+
+
+def _chunks(spec, chunk):
+    start = spec.get("start", 0)
+    end = start + spec["count"]
+    batch = spec.get("batch")
+    if batch is None:
+        batch = int(time.time())
+    for i in range(start, end, chunk):
+        yield (spec["template"], spec.get("serial_format", "%08i"),
+               batch, i, min(chunk, end-i))
+
+
+def _run(fn, tasks, jobs, timings):
+    """Map fn over tasks in worker processes, yielding results in order."""
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        for pid, elapsed, count, result in executor.map(fn, tasks):
+            timing = timings[pid]
+            timing[0] += 1
+            timing[1] += elapsed
+            timing[2] += count
+            yield result
+
+
+def _report(timings, elapsed, what, out=sys.stderr):
+    total = sum(count for tasks, busy, count in timings.values())
+    print("%-8s %6s %10s %9s" % ("worker", "tasks", what, "busy"), file=out)
+    for pid, (tasks, busy, count) in sorted(timings.items()):
+        print("%-8i %6i %10i %8.3fs" % (pid, tasks, count, busy), file=out)
+    print("%i %s in %.3fs (%.0f/s)" % (
+        total, what, elapsed, total / elapsed if elapsed else float('inf')), file=out)
+
+
+def generate(specs, jobs=None, chunk=1000):
+    timings = collections.defaultdict(lambda: [0, 0.0, 0])
+    start = time.time()
+    tasks = []
+    for i, spec in enumerate(specs):
+        tasks.extend((i, task) for task in _chunks(spec, chunk))
+
+    f = None
+    current = None
+    try:
+        for (i, task), images in zip(tasks, _run(_generate, [t for _, t in tasks], jobs, timings)):
+            if i != current:
+                if f:
+                    f.close()
+                f = open(specs[i]["out"], "wb")
+                current = i
+            f.write(images)
+    finally:
+        if f:
+            f.close()
+    _report(timings, time.time() - start, "images")
+    return 0
+
+
+def verify(filenames, jobs=None, chunk=1 << 20):
+    timings = collections.defaultdict(lambda: [0, 0.0, 0])
+    start = time.time()
+    tasks = []
+    for filename in filenames:
+        tasks.extend(_split(filename, chunk))
+    by_file = collections.OrderedDict((filename, []) for filename in filenames)
+    for (filename, _, _), results in zip(tasks, _run(_verify, tasks, jobs, timings)):
+        by_file[filename].extend(results)
+
+    bad = 0
+    for filename, results in by_file.items():
+        errors = [(offset, error) for offset, error in results if error]
+        print("%s: %i ok, %i bad" % (filename, len(results) - len(errors), len(errors)))
+        for offset, error in errors:
+            print("  @0x%x: %s" % (offset, error))
+        bad += len(errors)
+    _report(timings, time.time() - start, "images")
+    return 1 if bad else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--jobs", "-j", type=int, default=None,
+                        help="worker processes (default CPU count)")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    p = commands.add_parser("generate", parents=[common], help="generate images from specs")
+    p.add_argument("specs", help="JSON file with a list of image specs")
+    p.add_argument("--chunk", type=int, default=1000, help="images per task")
+
+    p = commands.add_parser("verify", parents=[common], help="verify image files")
+    p.add_argument("files", nargs="+")
+    p.add_argument("--chunk-size", type=int, default=1 << 20,
+                   help="bytes per task (default %(default)s)")
+
+    args = parser.parse_args(argv)
+    if args.command == "generate":
+        with open(args.specs) as f:
+            specs = json.load(f)
+        return generate(specs, args.jobs, args.chunk)
+    else:
+        return verify(args.files, args.jobs, args.chunk_size)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
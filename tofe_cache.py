@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set ts=4 sw=4 et sts=4 ai:
+
+"""
+LRU cache of decoded TOFE EEPROM images.
+
+Services which are asked about the same EEPROM contents again and again
+(every board of a batch has the same image, bar the serial) can keep the
+decoded atoms and the rendered repr() of each image instead of parsing it
+every time.
+
+Entries are keyed by the image bytes. The dict hashes them and compares the
+bytes on a match, so a hit is never a different image. The header (magic,
+crc8 and length) alone would not do as a key, with an 8 bit CRC images of
+the same length collide after a few dozen.
+
+>>> from tofe_eeprom import *
+>>> images = [TOFEAtoms.build([
+...     AtomProductID.create("tofe.io/milkymist"),
+...     AtomProductSerial.create("MM%06i" % i),
+... ]).as_bytearray() for i in range(0, 3)]
+>>> cache = ImageCache(2)
+>>> cache.atoms(images[0])[1]
+(<class 'tofe_eeprom.AtomProductSerial'>, 'MM000000')
+>>> print(cache.text(images[0]))
+TOFEAtoms
+magic: b'TOFE'
+version: 0x1
+atoms: 0x2
+crc8: 0x2
+atoms (2, 29 bytes):
+    (0, AtomProductID('https://tofe.io/milkymist'))
+    (1, AtomProductSerial('MM000000'))
+ragic: bytearray(b'\\x00EFOT')
+>>> for image in images[1:] + images[:1]:
+...     _ = cache.get(image)
+>>> cache.stats()
+{'size': 2, 'maxsize': 2, 'hits': 1, 'misses': 4, 'evictions': 2}
+>>> images[1] in cache, images[2] in cache
+(False, True)
+
+Invalid images are not cached:
+
+>>> images[2][20] ^= 1
+>>> cache.get(images[2])
+Traceback (most recent call last):
+    ...
+ValueError: Invalid crc8 0x50 (calculated 0x80)
+>>> len(cache)
+2
+"""
+
+import collections
+
+from tofe_eeprom import TOFEAtoms, decode_image
+
+
+class Decoded(object):
+    """A decoded image, its atoms and (rendered on first use) text."""
+    __slots__ = ("image", "atoms", "_text", "_cls")
+
+    def __init__(self, image, atoms, cls):
+        self.image = image
+        self.atoms = atoms
+        self._text = None
+        self._cls = cls
+
+    @property
+    def text(self):
+        if self._text is None:
+            t = self._cls.from_buffer(self.image, check=False)
+            self._text = repr(t)
+        return self._text
+
+
+class ImageCache(object):
+    """Least recently used cache of up to maxsize decoded images.
+
+    maxsize can be changed at any time, the least recently used entries are
+    then evicted to fit. None means no limit.
+    """
+
+    def __init__(self, maxsize=1024, cls=TOFEAtoms):
+        self._entries = collections.OrderedDict()
+        self._maxsize = maxsize
+        self.cls = cls
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    @maxsize.setter
+    def maxsize(self, maxsize):
+        self._maxsize = maxsize
+        self._evict()
+
+    def _evict(self):
+        if self._maxsize is None:
+            return
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, image):
+        """The Decoded entry for image (bytes-like), decoding it on a miss.
+
+        Raises ValueError for invalid images, which are not cached.
+        """
+        key = bytes(image)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        entry = Decoded(key, tuple(decode_image(key, self.cls)), self.cls)
+        self._entries[key] = entry
+        self._evict()
+        return entry
+
+    def atoms(self, image):
+        """The (atom class, value) pairs of image, see decode_image()."""
+        return self.get(image).atoms
+
+    def text(self, image):
+        """repr() of the image."""
+        return self.get(image).text
+
+    def __contains__(self, image):
+        return bytes(image) in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "maxsize": self._maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set ts=4 sw=4 et sts=4 ai:
+
+"""
+Table driven CRC-8 used by the TOFE EEPROM format.
+
+Polynomial 0x107, initial value 0x00, not reflected, no final xor. This is
+crcmod's predefined 'crc-8' and uses the same table which
+tofe_eeprom_crc.py generates for the C side.
+
+>>> hex(crc8(b"123456789"))
+'0xf4'
+>>> hex(_crc8_python(b"123456789"))
+'0xf4'
+>>> hex(crc8(b"6789", crc8(b"12345")))
+'0xf4'
+>>> import crcmod
+>>> list(TABLE) == crcmod.Crc(POLY, rev=False).table
+True
+"""
+
+POLY = 0x107
+
+
+def _table(poly):
+    table = []
+    for i in range(0, 256):
+        crc = i
+        for j in range(0, 8):
+            crc <<= 1
+            if crc & 0x100:
+                crc ^= poly
+        table.append(crc & 0xff)
+    return bytes(table)
+
+TABLE = _table(POLY)
+
+
+def _crc8_python(data, crc=0, table=TABLE):
+    for b in data:
+        crc = table[crc ^ b]
+    return crc
+
+
+def _crc8_native():
+    try:
+        from crcmod._crcfunext import _crc8
+    except ImportError:
+        return None
+
+    def crc8(data, crc=0, table=TABLE):
+        return _crc8(data, crc, table)
+    return crc8
+
+
+def crc8(data, crc=0):
+    """Calculate the CRC-8 of any bytes-like data continuing from crc.
+
+    crcmod's C extension is only looked for on the first call, so importing
+    this module stays cheap. This function then replaces itself with the
+    native or the pure Python implementation.
+    """
+    global crc8
+    crc8 = _crc8_native() or _crc8_python
+    return crc8(data, crc)
+
+
+def crc8_segments(segments, crc=0):
+    """Calculate the CRC-8 over several buffers as if they were one.
+
+    >>> hex(crc8_segments([b"123", bytearray(b"456"), memoryview(b"789")]))
+    '0xf4'
+    """
+    for segment in segments:
+        crc = crc8(segment, crc)
+    return crc
+
+
+def crc8_skip(data, skip, crc=0):
+    """Calculate the CRC-8 of data leaving out the byte at offset skip.
+
+    data must support the buffer protocol, it is never copied.
+
+    >>> hex(crc8_skip(b"1234X56789", 4))
+    '0xf4'
+    >>> hex(crc8_skip(b"123456789X", 9))
+    '0xf4'
+    """
+    data = memoryview(data).cast('B')
+    return crc8(data[skip+1:], crc8(data[:skip], crc))
+
+
+def _mulmod(a, b, poly=POLY):
+    """Multiply two polynomials modulo poly over GF(2)."""
+    r = 0
+    while b:
+        if b & 1:
+            r ^= a
+        b >>= 1
+        a <<= 1
+        if a & 0x100:
+            a ^= poly
+    return r
+
+
+def _shift(crc, n):
+    """CRC state after feeding n zero bytes, crc * x^(8n) mod poly."""
+    # x^8 mod poly
+    base = TABLE[1]
+    while n:
+        if n & 1:
+            crc = _mulmod(crc, base)
+        n >>= 1
+        base = _mulmod(base, base)
+    return crc
+
+
+def crc8_combine(crc_a, crc_b, len_b):
+    """Calculate crc8(a + b) from crc8(a), crc8(b) and len(b).
+
+    Takes O(log len_b) time, so the CRC of a prefix can be changed without
+    hashing what follows it again.
+
+    >>> a, b = b"12345", b"6789"
+    >>> hex(crc8_combine(crc8(a), crc8(b), len(b)))
+    '0xf4'
+    >>> crc8_combine(0x5a, crc8(bytes(1000)), 1000) == crc8(bytes(1000), 0x5a)
+    True
+    """
+    return _shift(crc_a, len_b) ^ crc_b
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
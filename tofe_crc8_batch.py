@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set ts=4 sw=4 et sts=4 ai:
+
+"""
+Check the CRC-8 of many TOFE EEPROM images at once with NumPy.
+
+Images are grouped by length rounded up to a bucket size and stacked into
+a 2D array, right aligned with zeros in front. The CRC has no initial value
+so leading zeros do not change it. The table driven CRC is then run over
+the byte positions, updating every image in the bucket with each table
+lookup, and leaving out the crc8 header byte of each image.
+
+Each image is cut to the length in its header first, so padding after it
+(an EEPROM dump is 0xff to the end) is not hashed. Only the CRC and that
+length are checked, use TOFEAtoms.from_buffer() for the structure.
+
+>>> from tofe_eeprom import *
+>>> images = [TOFEAtoms.build([AtomProductSerial.create("MM%06i" % i)]).as_bytearray()
+...           for i in range(0, 1000)]
+>>> images.append(TOFEAtoms.build([AtomComment.create("Thanks for backing!")]).as_bytearray())
+>>> images[10][20] ^= 1
+>>> images[-1][7] ^= 1
+>>> ok, failed = verify(images)
+>>> int(ok.sum()), failed
+(999, array([  10, 1000]))
+
+Dumps of a whole EEPROM, and images cut short:
+
+>>> dumps = [bytes(image) + b"\\xff" * (256 - len(image)) for image in images[:3]]
+>>> dumps += [images[3][:11], images[4][:-1]]
+>>> verify(dumps)[1]
+array([3, 4])
+"""
+
+import struct
+
+import numpy
+
+from tofe_crc8 import TABLE
+from tofe_eeprom import TOFEAtoms
+
+_TABLE = numpy.frombuffer(TABLE, dtype=numpy.uint8)
+
+
+def crc8_columns(columns, skip):
+    r"""CRC-8 of each column of a 2D uint8 array, leaving out row skip.
+
+    Each image is a column so the bytes processed together are contiguous.
+    skip is a row number or an array with one for each column.
+
+    >>> from tofe_crc8 import crc8, crc8_skip
+    >>> rows = numpy.array([list(b"1234X56789"), list(b"\x00\x0012345678")], dtype=numpy.uint8)
+    >>> [hex(c) for c in crc8_columns(rows.T, numpy.array([4, 10]))]
+    ['0xf4', '0xc7']
+    >>> hex(crc8_skip(b"1234X56789", 4)), hex(crc8(b"12345678"))
+    ('0xf4', '0xc7')
+    """
+    crc = numpy.zeros(columns.shape[1], dtype=numpy.uint8)
+    tmp = numpy.empty_like(crc)
+    if numpy.ndim(skip) == 0:
+        for j in range(0, columns.shape[0]):
+            if j != skip:
+                numpy.bitwise_xor(crc, columns[j], out=tmp)
+                _TABLE.take(tmp, out=crc)
+        return crc
+    for j in range(0, columns.shape[0]):
+        crc = numpy.where(skip == j, crc, _TABLE.take(crc ^ columns[j]))
+    return crc
+
+
+def verify(images, cls=TOFEAtoms, bucket=16):
+    """Check the stored crc8 of each image (bytes-like objects).
+
+    Anything after the length given in the header is ignored. Images shorter
+    than their header or than that length fail.
+
+    Returns a boolean array with True for the images whose CRC is correct,
+    and the indexes of the others.
+    """
+    crc_offset = cls.crc8.offset
+    len_offset = cls._len.offset
+    header_size = len_offset + cls._len.size
+    ok = numpy.zeros(len(images), dtype=bool)
+
+    images = list(images)
+    buckets = {}
+    for i, image in enumerate(images):
+        if len(image) < header_size:
+            continue
+        size = header_size + struct.unpack_from("<I", image, len_offset)[0]
+        if len(image) < size:
+            continue
+        if len(image) > size:
+            images[i] = memoryview(image)[:size]
+        width = -(-size // bucket) * bucket
+        buckets.setdefault(width, []).append(i)
+
+    for width, indexes in buckets.items():
+        lengths = numpy.fromiter((len(images[i]) for i in indexes), numpy.intp, len(indexes))
+        if (lengths == lengths[0]).all():
+            width = int(lengths[0])
+            data = b"".join(images[i] for i in indexes)
+        else:
+            zeros = bytes(width)
+            data = b"".join(zeros[len(images[i]):] + images[i] for i in indexes)
+        columns = numpy.frombuffer(data, dtype=numpy.uint8).reshape(len(indexes), width).T.copy()
+        skip = width - lengths + crc_offset
+        stored = columns[skip, numpy.arange(len(indexes))]
+        if (skip == skip[0]).all():
+            skip = int(skip[0])
+        ok[indexes] = crc8_columns(columns, skip) == stored
+
+    return ok, numpy.flatnonzero(~ok)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set ts=4 sw=4 et sts=4 ai:
+
+"""
+Plan the page writes needed to update an EEPROM from one image to another.
+
+I2C EEPROMs are written a page at a time and every write, however short,
+costs a full write cycle (5ms on the 24LC01B). Only the pages with changed
+bytes are written, each from its first to its last changed byte. The header
+is compared like any other bytes, so changes to crc8 and _len are included.
+
+  ./tofe_diff.py dump.bin new.bit --page-size 8
+"""
+
+import argparse
+import collections
+import sys
+
+from tofe_eeprom import DynamicLengthStructure
+
+Write = collections.namedtuple("Write", "offset data")
+
+
+def _bytes(image):
+    if isinstance(image, DynamicLengthStructure):
+        return bytes(image.as_bytearray())
+    return bytes(image)
+
+
+def plan(old, new, page_size):
+    r"""Return the Writes turning old into new.
+
+    old can be longer than new (a dump of the whole EEPROM), anything after
+    the end of new is left alone. Bytes of new past the end of old are
+    always written.
+
+    >>> new = bytearray(25)
+    >>> new[1], new[22], new[23], new[24] = 1, 2, 2, 3
+    >>> plan(bytes(32), new, 8)
+    [Write(offset=1, data=b'\x01'), Write(offset=22, data=b'\x02\x02'), Write(offset=24, data=b'\x03')]
+    >>> plan(b"\0" * 4, b"\0" * 4 + b"\5" * 12, 8)
+    [Write(offset=4, data=b'\x05\x05\x05\x05'), Write(offset=8, data=b'\x05\x05\x05\x05\x05\x05\x05\x05')]
+    >>> plan(b"abcdefgh", b"aXcdefYh", 8)
+    [Write(offset=1, data=b'XcdefY')]
+    """
+    old = _bytes(old)
+    new = _bytes(new)
+    assert page_size > 0, page_size
+
+    writes = []
+    for page in range(0, len(new), page_size):
+        end = min(page + page_size, len(new))
+        if old[page:end] == new[page:end]:
+            continue
+        first = None
+        for i in range(page, end):
+            if i >= len(old) or old[i] != new[i]:
+                if first is None:
+                    first = i
+                last = i
+        if first is not None:
+            writes.append(Write(first, new[first:last+1]))
+    return writes
+
+
+def apply(image, writes):
+    r"""Return image with the writes applied.
+
+    >>> from tofe_eeprom import *
+    >>> def board(serial):
+    ...     return TOFEAtoms.build([
+    ...         AtomProductID.create("tofe.io/milkymist"),
+    ...         AtomProductSerial.create(serial),
+    ...         AtomComment.create("Thanks for backing!"),
+    ...     ])
+    >>> old, new = board("MM000001"), board("MM000002")
+    >>> writes = plan(old, new, 8)
+    >>> [(w.offset, w.data) for w in writes]
+    [(7, b'\xcb'), (40, b'2')]
+    >>> apply(old.as_bytearray(), writes) == new.as_bytearray()
+    True
+    >>> # A longer serial changes _len and moves everything after it.
+    >>> len(plan(old, board("MM0000001"), 8))
+    7
+    """
+    image = bytearray(_bytes(image))
+    for w in writes:
+        if w.offset + len(w.data) > len(image):
+            image.extend(bytes(w.offset + len(w.data) - len(image)))
+        image[w.offset:w.offset+len(w.data)] = w.data
+    return image
+
+
+def estimate(writes, clock=100000, address_bytes=1, write_cycle=0.005):
+    """Estimate the seconds taken by writes on an I2C EEPROM.
+
+    Each write sends a start, the device address, address_bytes of memory
+    address and the data (9 clocks a byte with the ack) and then waits out
+    the write cycle.
+
+    >>> round(estimate([Write(0, bytes(8))] * 16), 4)
+    0.0947
+    >>> round(estimate([Write(0, bytes(64))] * 256, 400000, 2, 0.005), 3)
+    1.667
+    """
+    total = 0
+    for w in writes:
+        clocks = 1 + 9 * (1 + address_bytes + len(w.data)) + 1
+        total += clocks / clock + write_cycle
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("old", help="current EEPROM contents (image or dump)")
+    parser.add_argument("new", help="image to write")
+    parser.add_argument("--page-size", type=int, default=8,
+                        help="EEPROM page size in bytes (default %(default)s)")
+    parser.add_argument("--clock", type=int, default=100000,
+                        help="I2C clock in Hz (default %(default)s)")
+    parser.add_argument("--address-bytes", type=int, default=1,
+                        help="memory address bytes (default %(default)s)")
+    parser.add_argument("--write-cycle", type=float, default=0.005,
+                        help="write cycle time in seconds (default %(default)s)")
+    args = parser.parse_args(argv)
+
+    with open(args.old, "rb") as f:
+        old = f.read()
+    with open(args.new, "rb") as f:
+        new = f.read()
+
+    def time(writes):
+        return estimate(writes, args.clock, args.address_bytes, args.write_cycle)
+
+    writes = plan(old, new, args.page_size)
+    for w in writes:
+        print("0x%04x %s" % (w.offset, w.data.hex()))
+    full = plan(b"", new, args.page_size)
+    print("%i writes, %i bytes, %.1fms (full rewrite %i writes, %.1fms)" % (
+        len(writes), sum(len(w.data) for w in writes), time(writes) * 1e3,
+        len(full), time(full) * 1e3), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -243,6 +243,60 @@ char* tofe_atom_print_size_offset(char* ptr, const struct tofe_atomfmt_size_offs
 	return ptr;
 }
 
+/* Must match AtomFormatCompressedString.DICTIONARY in tofe_eeprom.py */
+const char* const tofe_compressed_string_dictionary[] = {
+	" - ", " == ", " -> ", " (", ") ", ", ", ". ", ": ", "0x", "  ",
+	"    ", "00", "01", "10", "->", "the ", "The ", "and ", "for ",
+	"with ", "from ", "to ", "of ", "on ", "is ", "in ", "be ", "this ",
+	"This ", "not ", "are ", "all ", "you ", "use ", "see ", "when ",
+	"ing ", "ing", "tion", "ed ", "er ", "es ", "ly ", "nt", "th", "er",
+	"re", "on", "an", "in", "at", "en", "es", "or", "ti", "te", "al",
+	"ar", "st", "le", "Value", "Values", "Enable",
+	"Disable", "Update", "counter", "Channel", "Byte", "High", "Low",
+	"Control", "Register", "register", "Read", "Write", "Address", "Data",
+	"Status", "Reset", "Input", "Output", "Mode", "Select", "Interrupt",
+	"Clock", "Power", "Voltage", "Current", "Temperature", "Sensor",
+	"Pin", "Port", "Bit", "bit", "Version", "Serial", "Firmware",
+	"Hardware", "Board", "board", "Configuration", "ADC", "DAC", "LED",
+	"GPIO", "I2C", "SPI", "UART", "PWM", "USB", "HDMI", "EEPROM", "TOFE",
+	"FPGA", "JTAG", "https://", "github.com/", "tofe.io/", "hdmi2usb.tv/",
+	"timvideos/", "numato.com", ".com", ".git", ".html", "www.",
+};
+const size_t tofe_compressed_string_dictionary_len =
+	sizeof(tofe_compressed_string_dictionary) / sizeof(tofe_compressed_string_dictionary[0]);
+
+char* tofe_atom_print_binary_blob(char* ptr, const struct tofe_atomfmt_binary_blob* atom) {
+	for (size_t i = 0; i < atom->len; i++) {
+		ptr += sprintf(ptr, "%02x", atom->data[i]);
+	}
+	return ptr;
+}
+
+char* tofe_atom_print_compressed_string(char* ptr, const struct tofe_atomfmt_compressed_string* atom) {
+	for (size_t i = 0; i < atom->len; i++) {
+		__u8 d = atom->data[i];
+		if (d == TOFE_COMPRESSED_STRING_ESCAPE) {
+			if (i + 1 >= atom->len) {
+				/* Escape with nothing left to escape */
+				*ptr++ = '?';
+				break;
+			}
+			*ptr++ = atom->data[++i];
+		} else if (d >= TOFE_COMPRESSED_STRING_DICT_START) {
+			size_t code = d - TOFE_COMPRESSED_STRING_DICT_START;
+			if (code < tofe_compressed_string_dictionary_len) {
+				ptr = stpcpy(ptr, tofe_compressed_string_dictionary[code]);
+			} else {
+				*ptr++ = '?';
+			}
+		} else {
+			*ptr++ = d;
+		}
+	}
+	*ptr = '\0';
+	return ptr;
+}
+
 #define TOFE_ATOM_PRINT_CASE(name) \
 	case ATOM_STYLE ## name : \
 		return tofe_atom_print ## name (ptr, (const struct tofe_atomfmt ## name *)(atom))
@@ -265,6 +319,8 @@ char* tofe_atom_print(char* ptr, const struct tofe_atom* atom) {
 		;
 	TOFE_ATOM_PRINT_CASE(binary_blob)
 		;
+	TOFE_ATOM_PRINT_CASE(compressed_string)
+		;
 #ifdef NDEBUG
 	default:
 		return stpcpy(ptr, "??? (Unknown format)");
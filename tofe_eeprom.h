@@ -43,6 +43,7 @@ enum tofe_atomfmt {
 	ATOM_FMT_license	= 0x40,
 	ATOM_FMT_size_offset	= 0x50,
 	ATOM_FMT_binary_blob	= 0x60,
+	ATOM_FMT_compressed_string	= 0x70,
 };
 
 #define TOFE_EXTRA_LEN(x) \
@@ -63,6 +64,8 @@ DEFINE_TOFE_ATOM_GET_FMT(relative_url);
 DEFINE_TOFE_ATOM_GET_FMT(expand_int);
 DEFINE_TOFE_ATOM_GET_FMT(license);
 DEFINE_TOFE_ATOM_GET_FMT(size_offset);
+DEFINE_TOFE_ATOM_GET_FMT(binary_blob);
+DEFINE_TOFE_ATOM_GET_FMT(compressed_string);
 
 char* tofe_atom_print(char* ptr, const struct tofe_atom* atom);
 #define DECLARE_TOFE_ATOM_GET_FMT(name) \
@@ -202,6 +205,29 @@ DEFINE_TOFE_ATOM_SIZE_OFFSET(large, __u8);
 	} while(false)
 
 
+/* Binary Blob Format */
+struct tofe_atomfmt_binary_blob {
+	struct tofe_atom_header;
+	__u8 data[];
+} __attribute__ ((packed));
+
+/* Compressed String Format
+ *
+ * 0x00-0x7f are ASCII characters, 0x80 up are entries of
+ * tofe_compressed_string_dictionary (codes past its end are invalid) and
+ * 0xff escapes the next byte.
+ */
+#define TOFE_COMPRESSED_STRING_DICT_START	0x80
+#define TOFE_COMPRESSED_STRING_ESCAPE		0xff
+
+extern const char* const tofe_compressed_string_dictionary[];
+extern const size_t tofe_compressed_string_dictionary_len;
+
+struct tofe_atomfmt_compressed_string {
+	struct tofe_atom_header;
+	__u8 data[];
+} __attribute__ ((packed));
+
 // Specific atom types
 #define TOFE_ATOM_TYPE_ENUM(string, url, relative_url, expand_int, license, size_offset, binary_blob) \
 	(( \
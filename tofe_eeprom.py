@@ -4,15 +4,14 @@
 
 from __future__ import print_function
 
-import binascii
-import crcmod
 import ctypes
 import enum
-import math
-import re
+import struct
 import sys
 
-from utils import *
+from utils import assert_eq, print_struct
+
+import tofe_crc8
 
 # Remove after https://bugs.python.org/issue19023 is fixed.
 assert sys.byteorder == 'little'
@@ -197,23 +196,32 @@ class DynamicLengthStructure(ctypes.LittleEndianStructure):
 
         self._len = self._extra_size + value
 
+    @property
+    def _size(self):
+        """Size of the structure as described by _len.
+
+        Can differ from ctypes.sizeof(self) when the structure is a view
+        onto a larger buffer (from_buffer / from_address).
+        """
+        return self._extra_start + self._len
+
     @property
     def data(self):
         addr = ctypes.addressof(self)
         return (ctypes.c_ubyte * self.len).from_address(addr+self._extra_end)
 
+    def _raw(self):
+        """memoryview of the structure's bytes, without copying them."""
+        raw = (ctypes.c_ubyte * self._size).from_address(ctypes.addressof(self))
+        # Keep the structure alive for as long as the view is.
+        raw._owner = self
+        return memoryview(raw).cast('B')
+
     def as_bytearray(self):
-        return bytearray((ctypes.c_ubyte * ctypes.sizeof(self)).from_address(ctypes.addressof(self)))
+        return bytearray(self._raw())
 
     def crc_calculate(self):
-        raw_bytes = self.as_bytearray()
-        bytes_before = raw_bytes[0:self.__class__.crc8.offset]
-        bytes_after = raw_bytes[self.__class__.crc8.offset+1:]
-
-        crc = crcmod.predefined.Crc('crc-8')
-        crc.update(bytes_before)
-        crc.update(bytes_after)
-        return crc.crcValue
+        return tofe_crc8.crc8_skip(self._raw(), self.__class__.crc8.offset)
 
     def crc_check(self):
         return self.crc8 == self.crc_calculate()
@@ -243,6 +251,21 @@ class Atom(DynamicLengthStructure):
         """
         return "%s(%s)" % (self.__class__.__name__, repr(self.as_bytearray())[10:-1])
 
+    @classmethod
+    def decode(cls, buf, offset, n):
+        r"""Value of the atom with the n bytes after the atom header at
+        offset in buf (bytes or bytearray), without creating the atom.
+
+        >>> Atom.decode(b"\xff\x02\x01\x02", 2, 2)
+        b'\x01\x02'
+        """
+        return bytes(buf[offset:offset+n])
+
+    @classmethod
+    def encode(cls, data):
+        """Payload bytes of an atom with value data, the inverse of decode()."""
+        return bytes(data)
+
 assert ctypes.sizeof(Atom) == 2
 
 
@@ -297,6 +320,14 @@ class AtomFormatString(Atom):
         """
         return u"%s(%r)" % (self.__class__.__name__, self.str)
 
+    @classmethod
+    def decode(cls, buf, offset, n):
+        return buf[offset:offset+n].decode('utf-8')
+
+    @classmethod
+    def encode(cls, s):
+        return s.encode('utf-8')
+
 
 class AtomFormatURL(AtomFormatString):
     FORMAT = 0x10
@@ -349,6 +380,16 @@ class AtomFormatURL(AtomFormatString):
         """
         return u"%s(%r)" % (self.__class__.__name__, self.url)
 
+    @classmethod
+    def decode(cls, buf, offset, n):
+        return "https://" + buf[offset:offset+n].decode('utf-8')
+
+    @classmethod
+    def encode(cls, url):
+        if "://" in url:
+            url = url.split("://", 1)[-1]
+        return url.encode('utf-8')
+
 
 class AtomFormatRelativeURL(AtomFormatString):
     FORMAT = 0x20
@@ -412,6 +453,14 @@ class AtomFormatRelativeURL(AtomFormatString):
         else:
             return u"%s(%i, '%s')" % (self.__class__.__name__, self.index, self.str)
 
+    @classmethod
+    def decode(cls, buf, offset, n):
+        return (buf[offset], buf[offset+1:offset+n].decode('utf-8'))
+
+    @classmethod
+    def encode(cls, index, url):
+        return bytes((index,)) + url.encode('utf-8')
+
 
 class AtomFormatExpandInt(Atom):
 
@@ -448,20 +497,28 @@ class AtomFormatExpandInt(Atom):
     
     @property
     def v(self):
-        v = 0
-        for i, b in enumerate(self.data):
-            v |= b << i * 8
-        return v
+        return int.from_bytes(self.data, 'little')
 
     @v.setter
     def v(self, v):
-        b = []
-        while v > 0:
-            b.append(v & 0xff)
-            v = v >> 8
-
+        b = AtomFormatExpandInt.encode(v)
         self.len = len(b)
-        self.data[:] = bytearray(b)
+        ctypes.memmove(ctypes.addressof(self)+self._extra_end, b, len(b))
+
+    @classmethod
+    def encode_many(cls, values):
+        r"""Encode each of values as the bytes of an atom of this type.
+
+        >>> AtomFormatExpandInt.encode_many([0, 2, 2**63])
+        [b'\xff\x00', b'\xff\x01\x02', b'\xff\x08\x00\x00\x00\x00\x00\x00\x00\x80']
+        """
+        atom_type = cls.TYPE
+        encode = cls.encode
+        encoded = []
+        for v in values:
+            payload = encode(v)
+            encoded.append(bytes((atom_type, len(payload))) + payload)
+        return encoded
 
     def __repr__(self):
         r"""
@@ -474,6 +531,30 @@ class AtomFormatExpandInt(Atom):
         """
         return "%s(%i)" % (self.__class__.__name__, self.v)
 
+    # Payload length -> struct for the common lengths, decode() falls back to
+    # int.from_bytes() for the others.
+    CODECS = {
+        1: struct.Struct("<B"),
+        2: struct.Struct("<H"),
+        4: struct.Struct("<I"),
+        8: struct.Struct("<Q"),
+    }
+
+    @classmethod
+    def decode(cls, buf, offset, n):
+        r"""
+        >>> [AtomFormatExpandInt.decode(b"\x01\x02\x03\x04\x05", 1, n) for n in range(0, 5)]
+        [0, 2, 770, 262914, 84148994]
+        """
+        codec = cls.CODECS.get(n)
+        if codec is None:
+            return int.from_bytes(buf[offset:offset+n], 'little')
+        return codec.unpack_from(buf, offset)[0]
+
+    @classmethod
+    def encode(cls, v):
+        return v.to_bytes((v.bit_length() + 7) // 8, 'little')
+
 
 class AtomFormatTimestamp(AtomFormatExpandInt):
     FORMAT = 0x30
@@ -524,6 +605,18 @@ class AtomFormatTimestamp(AtomFormatExpandInt):
         o.ts = int(round(ts))
         return o
 
+    @classmethod
+    def encode(cls, ts):
+        r"""
+        >>> ts = [1421070400.0, 1451606400, 2**63]
+        >>> AtomFormatTimestamp.encode_many(ts) == [
+        ...     bytes(AtomFormatTimestamp.create(t).as_bytearray()) for t in ts]
+        True
+        """
+        v = int(round(ts)) - cls.EPOCH
+        assert v > 0, v
+        return super().encode(v)
+
     @property
     def ts(self):
         return self.EPOCH + self.v
@@ -544,6 +637,10 @@ class AtomFormatTimestamp(AtomFormatExpandInt):
         """
         return u"%s(%i)" % (self.__class__.__name__, self.ts)
 
+    @classmethod
+    def decode(cls, buf, offset, n):
+        return cls.EPOCH + super().decode(buf, offset, n)
+
 
 
 def _l(license, version):
@@ -606,6 +703,9 @@ class AtomFormatLicense(Atom):
         # -
         Proprietary     = 0xff
 
+    # Value -> Names, quicker than calling Names()
+    _NAMES = {n.value: n for n in Names}
+
     _anonymous_ = ("_license",)
     _fields_ = [
         ("_license", _NamesUnion),
@@ -649,23 +749,29 @@ class AtomFormatLicense(Atom):
         assert isinstance(license, self.Names), repr(license)
         self._value = license.value
         
-    @property
-    def license(self):
-        return " ".join(self.value.name.split('_')[:-1])
-
-    @property
-    def version(self):
-        vstr = self.value.name.rsplit('_')[-1]
+    @classmethod
+    def describe(cls, value):
+        """(license, version) of a Names member, e.g. ('CC BY SA', 3.0)."""
+        name = value.name.split('_')
+        vstr = name[-1]
         if not vstr.startswith('v'):
-            return vstr
-        
+            return (" ".join(name[:-1]), vstr)
+
         if len(vstr) == 2:
-            return int(vstr[1])
+            return (" ".join(name[:-1]), int(vstr[1]))
         elif len(vstr) == 3:
-            return int(vstr[1]) + (int(vstr[2])/10.0)
+            return (" ".join(name[:-1]), int(vstr[1]) + (int(vstr[2])/10.0))
 
         assert False, "Invalid version %r" % vstr
 
+    @property
+    def license(self):
+        return self.describe(self.value)[0]
+
+    @property
+    def version(self):
+        return self.describe(self.value)[1]
+
     def __repr__(self):
         r"""
         >>> a1 = AtomFormatLicense.create(AtomFormatLicense.Names.GPL_v2)
@@ -677,6 +783,18 @@ class AtomFormatLicense(Atom):
         """
         return u"%s(%s, %s)" % (self.__class__.__name__, self.license, self.version)
 
+    @classmethod
+    def decode(cls, buf, offset, n):
+        license = cls._NAMES.get(buf[offset]) if n == 1 else None
+        if license is None:
+            raise ValueError("Invalid license %r" % bytes(buf[offset:offset+n]))
+        return license
+
+    @classmethod
+    def encode(cls, license):
+        assert isinstance(license, cls.Names), repr(license)
+        return bytes((license.value,))
+
 
 class AtomFormatSizeOffset(Atom):
     FORMAT = 0x50
@@ -703,6 +821,13 @@ class AtomFormatSizeOffset(Atom):
             ("size",    ctypes.c_uint32),
         ]
 
+    # Payload length -> (offset, size) codec
+    CODECS = {
+        ctypes.sizeof(Small):   struct.Struct("<BB"),
+        ctypes.sizeof(Medium):  struct.Struct("<HH"),
+        ctypes.sizeof(Large):   struct.Struct("<II"),
+    }
+
     _fields_ = [
         ("_data", ctypes.c_ubyte * 0),
     ]
@@ -731,47 +856,37 @@ class AtomFormatSizeOffset(Atom):
         >>> e.as_bytearray()
         bytearray(b'\xff\x04\xbc\x02\n\x00')
         """
-        if offset < 2**8 and size < 2**8:
-            struct = AtomFormatSizeOffset.Small
-        elif offset < 2**16 and size < 2**16:
-            struct = AtomFormatSizeOffset.Medium
-        elif offset < 2**32 and size < 2**32:
-            struct = AtomFormatSizeOffset.Large
-        else:
-            assert False
-
+        payload = cls.encode(offset, size)
         o = cls(type=cls.TYPE)
-        o.len = ctypes.sizeof(struct)
-        o.offset = offset
-        o.size = size
+        o.len = len(payload)
+        o.data[:] = payload
         return o
 
     @property
-    def _data_struct(self):
-        if self.len == ctypes.sizeof(AtomFormatSizeOffset.Small):
-            return AtomFormatSizeOffset.Small.from_address(ctypes.addressof(self.data))
-        elif self.len == ctypes.sizeof(AtomFormatSizeOffset.Medium):
-            return AtomFormatSizeOffset.Medium.from_address(ctypes.addressof(self.data))
-        elif self.len == ctypes.sizeof(AtomFormatSizeOffset.Large):
-            return AtomFormatSizeOffset.Large.from_address(ctypes.addressof(self.data))
-        else:
-            assert False
+    def _values(self):
+        codec = self.CODECS.get(self.len)
+        assert codec is not None, self.len
+        return codec.unpack_from(self.data)
+
+    @_values.setter
+    def _values(self, values):
+        self.CODECS[self.len].pack_into(self.data, 0, *values)
 
     @property
     def offset(self):
-        return self._data_struct.offset
+        return self._values[0]
 
     @offset.setter
     def offset(self, value):
-        self._data_struct.offset = value
+        self._values = (value, self.size)
 
     @property
     def size(self):
-        return self._data_struct.size
+        return self._values[1]
 
     @size.setter
     def size(self, value):
-        self._data_struct.size = value
+        self._values = (self.offset, value)
 
     def __repr__(self):
         r"""
@@ -784,6 +899,218 @@ class AtomFormatSizeOffset(Atom):
         """
         return u"%s(0x%x, 0x%x)" % (self.__class__.__name__, self.offset, self.size)
 
+    @classmethod
+    def decode(cls, buf, offset, n):
+        codec = cls.CODECS.get(n)
+        if codec is None:
+            raise ValueError("Invalid size/offset length %i" % n)
+        return codec.unpack_from(buf, offset)
+
+    @classmethod
+    def encode(cls, offset, size):
+        """The shortest payload which holds both offset and size."""
+        for n in sorted(cls.CODECS):
+            if offset < 2**(4*n) and size < 2**(4*n):
+                return cls.CODECS[n].pack(offset, size)
+        assert False, (offset, size)
+
+
+class AtomFormatBinaryBlob(Atom):
+    FORMAT = 0x60
+    TYPES = {}
+
+    @classmethod
+    def create(cls, blob):
+        r"""
+        >>> a1 = AtomFormatBinaryBlob.create(b"\x00\x01\xfe")
+        >>> a1.len
+        3
+        >>> a1.blob
+        b'\x00\x01\xfe'
+        >>> a1.as_bytearray()
+        bytearray(b'\xff\x03\x00\x01\xfe')
+        >>> AtomFormatBinaryBlob.create(b"").as_bytearray()
+        bytearray(b'\xff\x00')
+        """
+        o = cls(type=cls.TYPE)
+        assert o.type == cls.TYPE
+        assert o._len == 0
+        o.blob = blob
+        return o
+
+    @property
+    def blob(self):
+        return bytes(self.data)
+
+    @blob.setter
+    def blob(self, b):
+        self.len = len(b)
+        self.data[:] = b
+
+    def __repr__(self):
+        r"""
+        >>> repr(AtomFormatBinaryBlob.create(b"\x00ab"))
+        "AtomFormatBinaryBlob(b'\\x00ab')"
+        """
+        return u"%s(%r)" % (self.__class__.__name__, self.blob)
+
+
+class AtomFormatCompressedString(AtomFormatString):
+    """String compressed with a small static dictionary.
+
+    Payload bytes 0x00-0x7f are ASCII characters, 0x80 up stand for
+    DICTIONARY[b - 0x80] and 0xff escapes the byte following it (used for
+    the bytes of non-ASCII UTF-8 characters). Codes between the end of the
+    dictionary and 0xff are invalid. The dictionary is part of the format,
+    entries can only ever be appended.
+    """
+    FORMAT = 0x70
+    TYPES = {}
+
+    ESCAPE = 0xff
+
+    DICTIONARY = (
+        # Punctuation and numbers
+        b" - ", b" == ", b" -> ", b" (", b") ", b", ", b". ", b": ", b"0x",
+        b"  ", b"    ", b"00", b"01", b"10", b"->",
+        # English
+        b"the ", b"The ", b"and ", b"for ", b"with ", b"from ", b"to ",
+        b"of ", b"on ", b"is ", b"in ", b"be ", b"this ", b"This ", b"not ",
+        b"are ", b"all ", b"you ", b"use ", b"see ", b"when ", b"ing ",
+        b"ing", b"tion", b"ed ", b"er ", b"es ", b"ly ", b"nt", b"th",
+        b"er", b"re", b"on", b"an", b"in", b"at", b"en", b"es", b"or",
+        b"ti", b"te", b"al", b"ar", b"st", b"le",
+        # Hardware
+        b"Value", b"Values", b"Enable", b"Disable", b"Update", b"counter",
+        b"Channel", b"Byte", b"High", b"Low", b"Control", b"Register",
+        b"register", b"Read", b"Write", b"Address", b"Data", b"Status",
+        b"Reset", b"Input", b"Output", b"Mode", b"Select", b"Interrupt",
+        b"Clock", b"Power", b"Voltage", b"Current", b"Temperature",
+        b"Sensor", b"Pin", b"Port", b"Bit", b"bit", b"Version", b"Serial",
+        b"Firmware", b"Hardware", b"Board", b"board", b"Configuration",
+        b"ADC", b"DAC", b"LED", b"GPIO", b"I2C", b"SPI", b"UART", b"PWM",
+        b"USB", b"HDMI", b"EEPROM", b"TOFE", b"FPGA", b"JTAG",
+        # Links
+        b"https://", b"github.com/", b"tofe.io/", b"hdmi2usb.tv/",
+        b"timvideos/", b"numato.com", b".com", b".git", b".html", b"www.",
+    )
+    assert len(DICTIONARY) <= ESCAPE - 0x80, len(DICTIONARY)
+
+    # First byte -> [(entry, code)]
+    _ENTRIES = {}
+    for _code, _entry in enumerate(DICTIONARY):
+        assert len(_entry) > 1 and max(_entry) < 0x80, _entry
+        _ENTRIES.setdefault(_entry[0], []).append((_entry, 0x80 + _code))
+    del _code, _entry
+
+    @classmethod
+    def compress(cls, b):
+        r"""Encode bytes, choosing the dictionary entries giving the shortest
+        output.
+
+        >>> c = AtomFormatCompressedString.compress(b"ADC Value (High Byte)")
+        >>> len(c), AtomFormatCompressedString.decompress(c)
+        (8, b'ADC Value (High Byte)')
+        >>> AtomFormatCompressedString.compress(u"\u2603".encode('utf-8'))
+        b'\xff\xe2\xff\x98\xff\x83'
+        """
+        n = len(b)
+        # cost[i] is the shortest encoding of b[i:], made of choice[i] and
+        # the encoding of b[i+len(choice[i]):].
+        cost = [0] * (n + 1)
+        choice = [None] * n
+        for i in range(n - 1, -1, -1):
+            c = b[i]
+            best = (2 if c >= 0x80 else 1) + cost[i+1]
+            pick = None
+            for entry, code in cls._ENTRIES.get(c, ()):
+                end = i + len(entry)
+                if end <= n and 1 + cost[end] < best and b[i:end] == entry:
+                    best = 1 + cost[end]
+                    pick = (entry, code)
+            cost[i] = best
+            choice[i] = pick
+
+        out = bytearray()
+        i = 0
+        while i < n:
+            pick = choice[i]
+            if pick is not None:
+                out.append(pick[1])
+                i += len(pick[0])
+                continue
+            if b[i] >= 0x80:
+                out.append(cls.ESCAPE)
+            out.append(b[i])
+            i += 1
+        return bytes(out)
+
+    @classmethod
+    def decompress(cls, c):
+        r"""
+        >>> import random
+        >>> r = random.Random(0)
+        >>> alphabet = b"".join(AtomFormatCompressedString.DICTIONARY) + bytes(range(256))
+        >>> for i in range(0, 500):
+        ...     b = bytes(r.choice(alphabet) for j in range(0, r.randint(0, 80)))
+        ...     c = AtomFormatCompressedString.compress(b)
+        ...     assert AtomFormatCompressedString.decompress(c) == b, (b, c)
+        >>> AtomFormatCompressedString.decompress(b"a\xff")
+        Traceback (most recent call last):
+            ...
+        ValueError: Compressed string ends with an escape
+        >>> AtomFormatCompressedString.decompress(b"a\xfe")
+        Traceback (most recent call last):
+            ...
+        ValueError: Invalid dictionary code 0xfe
+        """
+        out = bytearray()
+        escape = False
+        for d in c:
+            if escape or d < 0x80:
+                out.append(d)
+                escape = False
+            elif d == cls.ESCAPE:
+                escape = True
+            else:
+                try:
+                    out += cls.DICTIONARY[d - 0x80]
+                except IndexError:
+                    raise ValueError("Invalid dictionary code 0x%02x" % d)
+        if escape:
+            raise ValueError("Compressed string ends with an escape")
+        return bytes(out)
+
+    @property
+    def str(self):
+        r"""
+        >>> a1 = AtomFormatCompressedString.create("Y == 2 - ADC Value (Low Byte)")
+        >>> a1.len
+        12
+        >>> a1.str
+        'Y == 2 - ADC Value (Low Byte)'
+        >>> a2 = AtomFormatCompressedString.create(u"\u2603 the board")
+        >>> a2.as_bytearray()
+        bytearray(b'\xff\t\xff\xe2\xff\x98\xff\x83 \x8f\xe3')
+        >>> repr(a2)
+        "AtomFormatCompressedString('☃ the board')"
+        """
+        return self.decompress(bytes(self.data)).decode('utf-8')
+
+    @str.setter
+    def str(self, s):
+        c = AtomFormatCompressedString.encode(s)
+        self.len = len(c)
+        self.data[:] = c
+
+    @classmethod
+    def decode(cls, buf, offset, n):
+        return cls.decompress(buf[offset:offset+n]).decode('utf-8')
+
+    @classmethod
+    def encode(cls, s):
+        return cls.compress(s.encode('utf-8'))
+
 
 class AtomCommentOn(AtomFormatString):
     TYPE = 0xd1
@@ -833,6 +1160,49 @@ class AtomCommentOn(AtomFormatString):
         """
         return u"%s(%i, '%s')" % (self.__class__.__name__, self.index, self.str)
 
+    @classmethod
+    def decode(cls, buf, offset, n):
+        return (buf[offset], buf[offset+1:offset+n].decode('utf-8'))
+
+    @classmethod
+    def encode(cls, index, s):
+        return bytes((index,)) + s.encode('utf-8')
+
+
+class AtomCompressedCommentOn(AtomFormatCompressedString):
+    TYPE = 0xd2
+
+    _fields_ = [
+        ("index", ctypes.c_uint8),
+        ("_data", ctypes.c_char * 0),
+    ]
+
+    @classmethod
+    def create(cls, index, str):
+        r"""
+        >>> a1 = AtomCompressedCommentOn.create(2, "LED Control")
+        >>> a1.as_bytearray()
+        bytearray(b'\xd2\x04\x02\xe7 \xc6')
+        >>> a1
+        AtomCompressedCommentOn(2, 'LED Control')
+        """
+        o = cls(type=cls.TYPE)
+        assert o.type == cls.TYPE
+        assert o._len == 1
+        o.index = index
+        o.str = str
+        return o
+
+    __repr__ = AtomCommentOn.__repr__
+
+    @classmethod
+    def decode(cls, buf, offset, n):
+        return (buf[offset], cls.decompress(buf[offset+1:offset+n]).decode('utf-8'))
+
+    @classmethod
+    def encode(cls, index, s):
+        return bytes((index,)) + cls.compress(s.encode('utf-8'))
+
 
 # Actual atoms
 ATOMS = [
@@ -870,6 +1240,7 @@ ATOMS = [
     ("Sample Code Repository",    AtomFormatRelativeURL),
     ("Documentation Site",        AtomFormatRelativeURL),
     ("Comment",                   AtomFormatString),
+    ("Compressed Comment",        AtomFormatCompressedString),
 ]
 
 ATOMS_TYPES = {}
@@ -877,23 +1248,28 @@ for i, (name, atom_format_cls) in enumerate(ATOMS):
     atom_i = len(atom_format_cls.TYPES)+1
     atom_type = atom_format_cls.FORMAT | atom_i
     assert atom_type not in ATOMS_TYPES
-    exec("""
-class Atom%(name)s(%(format)s):
-    ORDER = %(i)i
-    TYPE = %(atom_type)s
-
-ATOMS_TYPES[%(atom_type)s] = Atom%(name)s
-%(format)s.TYPES[%(atom_i)s] = Atom%(name)s
-""" % {
-        "i": i,
-        "name": "".join(name.split()),
-        "format": atom_format_cls.__name__,
-        "atom_i": hex(atom_i),
-        "atom_type": hex(atom_type),
+    atom_cls_name = "Atom" + "".join(name.split())
+    # type() of the format class is the ctypes structure metaclass.
+    atom_cls = type(atom_format_cls)(atom_cls_name, (atom_format_cls,), {
+        "__module__": __name__,
+        "__qualname__": atom_cls_name,
+        "ORDER": i,
+        "TYPE": atom_type,
     })
+    globals()[atom_cls_name] = atom_cls
+    ATOMS_TYPES[atom_type] = atom_cls
+    atom_format_cls.TYPES[atom_i] = atom_cls
 
 AtomCommentOn.ORDER = (i+1)
 ATOMS_TYPES[0xd1] = AtomCommentOn
+AtomCompressedCommentOn.ORDER = (i+1)
+ATOMS_TYPES[0xd2] = AtomCompressedCommentOn
+
+# class -> CRC of its magic and version, for decode_image()
+_HEADER_CRCS = {}
+
+# type -> (atom class, its bound decode()) for decode_image()
+_DECODERS = {atom_type: (atom_cls, atom_cls.decode) for atom_type, atom_cls in ATOMS_TYPES.items()}
 
 
 class AtomsCommon(DynamicLengthStructure):
@@ -907,12 +1283,90 @@ class AtomsCommon(DynamicLengthStructure):
         super().__init__()
         self.populate()
 
+    @classmethod
+    def from_buffer(cls, source, offset=0, check=True):
+        r"""Parse an existing image in place from a buffer.
+
+        The returned structure is a view onto source (a bytearray, writable
+        memoryview or mmap), nothing is copied. As the memory is not owned,
+        the image can be modified in place but not grown with add_atom().
+        Read-only sources (bytes, read-only memoryviews) are copied from
+        offset on first.
+
+        >>> t = TOFEAtoms()
+        >>> t.add_atom(AtomManufacturerID.create("numato.com"))
+        >>> t.add_atom(AtomProductID.create("tofe.io/milkymist"))
+        >>> b = bytearray(b'junk') + t.as_bytearray() + bytearray(b'more')
+        >>> p = TOFEAtoms.from_buffer(b, 4)
+        >>> p.atoms
+        2
+        >>> p.get_atom(1)
+        AtomProductID('https://tofe.io/milkymist')
+        >>> p.as_bytearray() == t.as_bytearray()
+        True
+
+        >>> b[4+12+3] = ord('N')
+        >>> TOFEAtoms.from_buffer(b, 4)
+        Traceback (most recent call last):
+            ...
+        ValueError: Invalid crc8 0x7e (calculated 0xf4)
+        >>> TOFEAtoms.from_buffer(b, 0)
+        Traceback (most recent call last):
+            ...
+        ValueError: Invalid magic b'junkT' (expected b'TOFE\x00')
+        >>> TOFEAtoms.from_buffer(bytes(t.as_bytearray())).get_atom(0)
+        AtomManufacturerID('https://numato.com')
+        """
+        if memoryview(source).readonly:
+            source = bytearray(memoryview(source).cast('B')[offset:])
+            offset = 0
+        o = type(cls).from_buffer(cls, source, offset)
+        if check:
+            o._check_buffer(len(memoryview(source).cast('B')) - offset)
+        return o
+
+    @classmethod
+    def from_file(cls, filename, check=True):
+        """Parse an image from a file by memory mapping it.
+
+        The mapping is copy-on-write, so changes to the returned structure
+        are never written back to the file.
+        """
+        import mmap
+        with open(filename, "rb") as f:
+            try:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            except ValueError:
+                raise ValueError("%s: empty file" % filename)
+        if len(m) < ctypes.sizeof(cls):
+            raise ValueError("%s: %i bytes is too short for header" % (filename, len(m)))
+        return cls.from_buffer(m, check=check)
+
+    def _check_buffer(self, available):
+        """Validate a structure parsed from a buffer with available bytes."""
+        magic = ctypes.string_at(ctypes.addressof(self), len(self.MAGIC))
+        if magic != self.MAGIC:
+            raise ValueError("Invalid magic %r (expected %r)" % (magic, self.MAGIC))
+        if self.version != self.VERSION:
+            raise ValueError("Invalid version 0x%x (expected 0x%x)" % (self.version, self.VERSION))
+        if self.len < len(self.RAGIC):
+            raise ValueError("Invalid length %i" % self.len)
+        if self._size > available:
+            raise ValueError("Length %i larger than buffer (%i bytes)" % (self._size, available))
+        if self.ragic != self.RAGIC:
+            raise ValueError("Invalid ragic %r (expected %r)" % (bytes(self.ragic), self.RAGIC))
+        self._atom_index()
+        crc = self.crc_calculate()
+        if self.crc8 != crc:
+            raise ValueError("Invalid crc8 0x%x (calculated 0x%x)" % (self.crc8, crc))
+
     def populate(self):
         self.magic = self.MAGIC
         self.version = self.VERSION
         self.atoms = 0
         self.len = len(self.RAGIC)
         self.data[:] = self.RAGIC[:]
+        self.index_invalidate()
         self.crc_update()
 
     def check(self):
@@ -921,49 +1375,274 @@ class AtomsCommon(DynamicLengthStructure):
         assert_eq(self.ragic, self.RAGIC)
         self.crc_check()
 
+    @classmethod
+    def _check_new_atom(cls, atom, i, previous_order):
+        """Check atom can be added as atom i after an atom of ORDER
+        previous_order (None for the first atom).
+
+        >>> atoms = [AtomComment.create("")] * 255
+        >>> TOFEAtoms.build(atoms).atoms
+        255
+        >>> TOFEAtoms.build(atoms + atoms[:1])
+        Traceback (most recent call last):
+            ...
+        ValueError: Too many atoms (256, the atoms field holds up to 255)
+
+        Relative atoms must point at an earlier atom:
+
+        >>> for atom_cls in (AtomCommentOn, AtomCompressedCommentOn):
+        ...     try:
+        ...         TOFEAtoms.build([AtomProductSerial.create("x"), atom_cls.create(9, "hi")])
+        ...     except AssertionError as e:
+        ...         print(atom_cls.__name__, e)
+        AtomCommentOn 9 < 1
+        AtomCompressedCommentOn 9 < 1
+        """
+        if i + 1 >= 2**(8*cls.atoms.size):
+            raise ValueError("Too many atoms (%i, the atoms field holds up to %i)" % (
+                i + 1, 2**(8*cls.atoms.size) - 1))
+
+        if previous_order is not None:
+            assert atom.ORDER >= previous_order
+
+        if isinstance(atom, (AtomFormatRelativeURL, AtomCommentOn, AtomCompressedCommentOn)):
+            assert atom.index < i, "%i < %i" % (atom.index, i)
+
+    @classmethod
+    def build(cls, atoms):
+        r"""Build an image from a list of atoms in a single pass.
+
+        Unlike calling add_atom() for each atom, the buffer is sized once
+        and the ragic and CRC are written once.
+
+        >>> atoms = [
+        ...     AtomManufacturerID.create("numato.com"),
+        ...     AtomProductID.create("tofe.io/milkymist"),
+        ...     AtomPCBRepository.create(1, "r/pcb.git"),
+        ...     AtomEEPROMTotalSize.create(0, 128),
+        ... ]
+        >>> t = TOFEAtoms.build(atoms)
+        >>> t.atoms
+        4
+        >>> t.crc_check()
+        True
+        >>> t.get_atom(2)
+        AtomPCBRepository('https://tofe.io/milkymist/r/pcb.git')
+        >>> t2 = TOFEAtoms()
+        >>> for a in atoms:
+        ...     t2.add_atom(a)
+        >>> t.as_bytearray() == t2.as_bytearray()
+        True
+        >>> TOFEAtoms.build([]).as_bytearray() == TOFEAtoms().as_bytearray()
+        True
+
+        >>> TOFEAtoms.build(atoms[::-1])
+        Traceback (most recent call last):
+            ...
+        AssertionError
+        """
+        atoms = list(atoms)
+        previous_order = None
+        for i, atom in enumerate(atoms):
+            cls._check_new_atom(atom, i, previous_order)
+            previous_order = atom.ORDER
+
+        atoms_len = sum(atom._size for atom in atoms)
+
+        o = cls.__new__(cls)
+        o.magic = cls.MAGIC
+        o.version = cls.VERSION
+        o.atoms = len(atoms)
+        o.len = atoms_len + len(cls.RAGIC)
+
+        addr = ctypes.addressof(o.data)
+        offsets = []
+        crc_atoms = 0
+        atom_offset = 0
+        for atom in atoms:
+            atom_size = atom._size
+            ctypes.memmove(addr+atom_offset, ctypes.addressof(atom), atom_size)
+            crc_atoms = tofe_crc8.crc8(atom._raw(), crc_atoms)
+            offsets.append(atom_offset)
+            atom_offset += atom_size
+        o.data[atoms_len:] = cls.RAGIC[:]
+
+        o._index_offsets = offsets
+        o._index_key = o._crc_atoms_key = o._index_current_key()
+        o._crc_atoms_value = crc_atoms
+        o.crc8 = o._crc_calculate_incremental()
+        return o
+
     def add_atom(self, atom):
+        r"""
+        >>> t = TOFEAtoms()
+        >>> t.add_atom(AtomProductSerial.create("MM000001"))
+        >>> # Atoms from get_atom() are views, editing them drops the cached CRC.
+        >>> t.get_atom(0).data[7] = ord("2")
+        >>> t.add_atom(AtomComment.create("Thanks for backing!"))
+        >>> t.crc_check()
+        True
+        """
         assert bytes(self.ragic) == self.RAGIC
 
+        index = self._atom_index()
+        previous_order = None
         if self.atoms > 0:
-            assert atom.ORDER >= self.get_atom(self.atoms-1).ORDER
-
-        if isinstance(atom, (AtomFormatRelativeURL, AtomCommentOn)):
-            assert atom.index < self.atoms, "%i < %i" % (atom.index, self.atoms)
+            previous_order = ATOMS_TYPES[self.data[index[-1]]].ORDER
+        self._check_new_atom(atom, self.atoms, previous_order)
 
-        atom_size = ctypes.sizeof(atom)
+        atom_size = atom._size
 
+        # _atom_index() above left _index_key current.
+        crc_atoms = self._crc_atoms(self._index_key)
         atom_offset = self.len - len(self.RAGIC)
         self.atoms += 1
 
         self.len += atom_size
         ctypes.memmove(ctypes.addressof(self.data)+atom_offset, ctypes.addressof(atom), atom_size)
         self.data[self.len - len(self.RAGIC):] = self.RAGIC[:]
-        self.crc_update()
+
+        index.append(atom_offset)
+        self._index_key = self._crc_atoms_key = self._index_current_key()
+
+        self._crc_atoms_value = tofe_crc8.crc8(atom._raw(), crc_atoms)
+        self.crc8 = self._crc_calculate_incremental()
+
+    def _crc_atoms(self, key=None):
+        """Running CRC (from zero) over the atoms, recalculated when stale.
+
+        key is the current _index_current_key() if the caller has it.
+        """
+        if key is None:
+            key = self._index_current_key()
+        if getattr(self, '_crc_atoms_key', None) != key:
+            start = self._extra_end
+            end = start + self.len - len(self.RAGIC)
+            self._crc_atoms_value = tofe_crc8.crc8(self._raw()[start:end])
+            self._crc_atoms_key = key
+        return self._crc_atoms_value
+
+    def _crc_calculate_incremental(self):
+        r"""CRC of the image reusing the running CRC of the atoms.
+
+        Only the header and ragic are hashed, the atoms are folded in with
+        crc8_combine(). crc_calculate() is the full recalculation.
+
+        >>> t = TOFEAtoms()
+        >>> for i in range(0, 40):
+        ...     t.add_atom(AtomProductSerial.create("%04i" % i))
+        ...     assert t.crc8 == t.crc_calculate(), i
+        >>> t.data[2:6] = list(b"XXXX")
+        >>> t.crc_check()
+        False
+        >>> t._crc_calculate_incremental() == t.crc_calculate()
+        True
+        """
+        raw = self._raw()
+        start = self._extra_end
+        atoms_len = self.len - len(self.RAGIC)
+        crc = tofe_crc8.crc8_skip(raw[:start], self.__class__.crc8.offset)
+        crc = tofe_crc8.crc8_combine(crc, self._crc_atoms(), atoms_len)
+        return tofe_crc8.crc8(raw[start+atoms_len:], crc)
+
+    def _index_current_key(self):
+        # The atom bytes themselves, so edits in place (through data, atom
+        # views or the buffer underneath) are noticed as well as changes of
+        # the count or length. Comparing them is a memcmp.
+        cls = self.__class__
+        start = cls._data.offset
+        atoms_len = self._len - (start - cls._len.offset - cls._len.size) - len(cls.RAGIC)
+        return (self.atoms, ctypes.string_at(ctypes.addressof(self) + start, max(0, atoms_len)))
+
+    def _index_build(self):
+        """Walk the atom chain once, returning the offset of each atom."""
+        offsets = []
+        data = self.data
+        atoms_len = self.len - len(self.RAGIC)
+        current_offset = 0
+        for i in range(0, self.atoms):
+            if current_offset + ctypes.sizeof(Atom) > atoms_len:
+                raise ValueError(
+                    "Atom %i header at %i overruns atoms (%i bytes)" % (
+                        i, current_offset, atoms_len))
+            offsets.append(current_offset)
+            current_offset += ctypes.sizeof(Atom) + data[current_offset+1]
+        if current_offset != atoms_len:
+            raise ValueError(
+                "Atoms end at %i but ragic starts at %i" % (
+                    current_offset, atoms_len))
+        return offsets
+
+    def _atom_index(self):
+        """Offsets of each atom relative to data, rebuilt when stale.
+
+        The index is keyed on the atom count and the atom bytes, so it is
+        rebuilt automatically after any change to them.
+        """
+        key = self._index_current_key()
+        if getattr(self, '_index_key', None) != key:
+            self._index_offsets = self._index_build()
+            self._index_key = key
+        return self._index_offsets
+
+    def index_invalidate(self):
+        """Forget the state cached from the atoms (offset index and CRC).
+
+        Never needed for correctness, the cached state is checked against
+        the atoms before it is used.
+        """
+        self._index_key = None
+        self._index_offsets = None
+        self._crc_atoms_key = None
 
     def get_atom(self, v):
+        r"""
+        >>> t = TOFEAtoms()
+        >>> t.add_atom(AtomManufacturerID.create("numato.com"))
+        >>> t.add_atom(AtomProductID.create("tofe.io/milkymist"))
+        >>> t.add_atom(AtomPCBRepository.create(1, "r/pcb.git"))
+        >>> t._atom_index()
+        [0, 12, 31]
+        >>> t.get_atom(2)
+        AtomPCBRepository('https://tofe.io/milkymist/r/pcb.git')
+        >>> [a.TYPE for a in t.iter_atoms()]
+        [18, 19, 33]
+
+        >>> # Rewriting the atoms in place is picked up by the index.
+        >>> t.data[1] = 12
+        >>> t.data[14:16] = [AtomProductID.TYPE, 15]
+        >>> t._atom_index()
+        [0, 14, 31]
+
+        >>> # The atom keeps its image alive, even a temporary one.
+        >>> a = TOFEAtoms.build([AtomProductSerial.create("MM000001")]).get_atom(0)
+        >>> junk = [bytearray(b"\xee" * 64) for i in range(0, 1000)]
+        >>> a
+        AtomProductSerial('MM000001')
+        """
         assert v < self.atoms, "%i < %i" % (v, self.atoms)
-        current_offset = 0
-        a = None
-        for i in range(0, v+1):
-            a = Atom.from_address(ctypes.addressof(self._data)+current_offset)
-            current_offset += ctypes.sizeof(Atom)
-            current_offset += a._len
-        assert a is not None, a
+        a = Atom.from_address(ctypes.addressof(self._data)+self._atom_index()[v])
         assert a.type in ATOMS_TYPES, a.type
         a = ATOMS_TYPES[a.type].from_address(ctypes.addressof(a))
+        # from_address() does not keep the image alive.
+        a._image = self
 
         if isinstance(a, AtomFormatRelativeURL):
-            assert a.index != i, "%i != %i" % (a.index, i)
+            assert a.index != v, "%i != %i" % (a.index, v)
             a._relative_atom = self.get_atom(a.index)
 
         return a
 
+    def iter_atoms(self):
+        for i in range(0, self.atoms):
+            yield self.get_atom(i)
+
     def __repr__(self):
         s = self.__class__.__name__ + "\n"
         s += print_struct(self) + "\n"
         s += "atoms (%i, %i bytes):\n" % (self.atoms, self.len - len(self.RAGIC))
-        for i in range(0, self.atoms):
-            s += "    (%i, %r)\n" % (i, self.get_atom(i))
+        for i, atom in enumerate(self.iter_atoms()):
+            s += "    (%i, %r)\n" % (i, atom)
         s += "ragic: %s\n" % self.ragic
         return s[:-1]
 
@@ -987,6 +1666,117 @@ class TOFEAtoms(AtomsCommon):
         ("_data",   ctypes.c_ubyte * 0),
     ]
 
+    # magic, version, atoms, crc8, _len
+    HEADER = struct.Struct("<5sBBBI")
+
+assert TOFEAtoms.HEADER.size == TOFEAtoms._data.offset
+
+
+def decode_image(image, cls=TOFEAtoms, check=True):
+    r"""Decode an image into a list of (atom class, value) in one pass.
+
+    The values are plain Python values decoded straight from the image
+    bytes by each atom class's decode(), no ctypes structures are created.
+    Relative URLs are (index, url) and size/offset atoms (offset, size).
+    With check, the image is validated like from_buffer() does.
+
+    >>> t = TOFEAtoms.build([
+    ...     AtomProductID.create("tofe.io/milkymist"),
+    ...     AtomProductSerial.create("MM000001"),
+    ...     AtomPCBRepository.create(0, "r/pcb.git"),
+    ...     AtomPCBLicense.create(AtomPCBLicense.Names.CC_BY_SA_v40),
+    ...     AtomPCBProductionBatchID.create(1450787283),
+    ...     AtomEEPROMTotalSize.create(0, 16*1024),
+    ...     AtomComment.create("Thanks for backing!"),
+    ...     AtomCompressedComment.create("LED Control Register"),
+    ...     AtomCommentOn.create(5, "16k"),
+    ...     AtomCompressedCommentOn.create(5, "Enable the LED"),
+    ... ])
+    >>> for atom_cls, value in decode_image(t.as_bytearray()):
+    ...     print(atom_cls.__name__, repr(value))
+    AtomProductID 'https://tofe.io/milkymist'
+    AtomProductSerial 'MM000001'
+    AtomPCBRepository (0, 'r/pcb.git')
+    AtomPCBLicense <Names.CC_BY_SA_v40: 69>
+    AtomPCBProductionBatchID 1450787283
+    AtomEEPROMTotalSize (0, 16384)
+    AtomComment 'Thanks for backing!'
+    AtomCompressedComment 'LED Control Register'
+    AtomCommentOn (5, '16k')
+    AtomCompressedCommentOn (5, 'Enable the LED')
+    >>> decode_image(t) == decode_image(bytes(t.as_bytearray()))
+    True
+
+    >>> b = t.as_bytearray()
+    >>> b[22] ^= 1
+    >>> decode_image(b)
+    Traceback (most recent call last):
+        ...
+    ValueError: Invalid crc8 0xca (calculated 0x5b)
+    >>> decode_image(b, check=False)[0][1]
+    'https://tofe.io/lilkymist'
+
+    >>> decode_image(b[:40])
+    Traceback (most recent call last):
+        ...
+    ValueError: Length 102 larger than buffer (28 bytes)
+    """
+    if isinstance(image, DynamicLengthStructure):
+        image = image._raw()
+    # Slicing and decoding bytes is cheaper than any other buffer.
+    if type(image) is not bytes:
+        image = bytes(image)
+    header = cls.HEADER
+    if len(image) < header.size:
+        raise ValueError("Truncated header (%i of %i bytes)" % (len(image), header.size))
+    magic, version, atoms, crc8, atoms_len = header.unpack_from(image)
+    start = header.size
+    end = start + atoms_len - len(cls.RAGIC)
+
+    if check:
+        if magic != cls.MAGIC:
+            raise ValueError("Invalid magic %r (expected %r)" % (magic, cls.MAGIC))
+        if version != cls.VERSION:
+            raise ValueError("Invalid version 0x%x (expected 0x%x)" % (version, cls.VERSION))
+        if atoms_len < len(cls.RAGIC):
+            raise ValueError("Invalid length %i" % atoms_len)
+        if start + atoms_len > len(image):
+            raise ValueError("Length %i larger than buffer (%i bytes)" % (
+                atoms_len, len(image) - start))
+        if image[end:start+atoms_len] != cls.RAGIC:
+            raise ValueError("Invalid ragic %r (expected %r)" % (
+                bytes(image[end:start+atoms_len]), cls.RAGIC))
+        # The magic and version are known to be right by now, so the atoms
+        # count is all that varies in the bytes before the crc8, one table
+        # lookup on from the CRC of the magic and version.
+        prefix = _HEADER_CRCS.get(cls)
+        if prefix is None:
+            prefix = _HEADER_CRCS[cls] = tofe_crc8.crc8(cls.MAGIC + bytes((cls.VERSION,)))
+        crc = tofe_crc8.crc8(image[cls.crc8.offset+1:start+atoms_len], tofe_crc8.TABLE[prefix ^ atoms])
+        if crc8 != crc:
+            raise ValueError("Invalid crc8 0x%x (calculated 0x%x)" % (crc8, crc))
+
+    decoders = _DECODERS
+    values = []
+    append = values.append
+    offset = start
+    for i in range(0, atoms):
+        if offset + 2 > end:
+            raise ValueError("Atom %i header at %i overruns atoms (%i bytes)" % (
+                i, offset - start, end - start))
+        try:
+            atom_cls, decode = decoders[image[offset]]
+        except KeyError:
+            raise ValueError("Unknown atom type 0x%02x" % image[offset])
+        n = image[offset+1]
+        offset += 2
+        append((atom_cls, decode(image, offset, n)))
+        offset += n
+    if offset != end:
+        raise ValueError("Atoms end at %i but ragic starts at %i" % (
+            offset - start, end - start))
+    return values
+
 
 if __name__ == "__main__":
     import doctest
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set ts=4 sw=4 et sts=4 ai:
+
+"""
+Read and program TOFE EEPROMs over I2C.
+
+Reads are sequential, one transfer for as many bytes as the adapter allows,
+and writes are whole pages followed by acknowledge polling until the write
+cycle is over. Images are read by fetching the header first and then exactly
+_len bytes, so nothing past the end of the image is transferred.
+
+SimulatedEEPROM keeps the contents in memory and models the bus and write
+cycle timing, so everything can be tested and benchmarked without hardware.
+
+  ./tofe_i2c.py --bus 1 --address 0x50 --size 128 --page-size 8 read -o dump.bit
+  ./tofe_i2c.py --bus 1 --address 0x50 --size 128 --page-size 8 program new.bit
+"""
+
+import argparse
+import errno
+import io
+import os
+import struct
+import sys
+import time
+
+import tofe_diff
+from tofe_eeprom import TOFEAtoms
+
+
+class EEPROM(object):
+    """An I2C EEPROM with address_bytes of memory address (big endian).
+
+    Backends implement _write(), returning False if the device did not
+    acknowledge, and _read().
+    """
+
+    # Largest read done in one transfer, None for no limit.
+    max_read = None
+
+    # Seconds to keep polling a busy device for.
+    poll_timeout = 0.05
+
+    def __init__(self, size, page_size, address_bytes=1):
+        assert size % page_size == 0, (size, page_size)
+        self.size = size
+        self.page_size = page_size
+        self.address_bytes = address_bytes
+
+    def _write(self, data):
+        raise NotImplementedError
+
+    def _read(self, n):
+        raise NotImplementedError
+
+    def _clock(self):
+        return time.monotonic()
+
+    def _select(self, data):
+        """Write data, polling until the device acknowledges."""
+        start = self._clock()
+        while not self._write(data):
+            if self._clock() - start > self.poll_timeout:
+                raise TimeoutError("No acknowledge from EEPROM after %.1fms" % (
+                    (self._clock() - start) * 1e3))
+
+    def _address(self, offset):
+        return offset.to_bytes(self.address_bytes, 'big')
+
+    def read(self, offset, n):
+        """Sequentially read n bytes from offset."""
+        assert 0 <= offset and offset + n <= self.size, (offset, n)
+        data = bytearray()
+        while n > 0:
+            chunk = n if self.max_read is None else min(n, self.max_read)
+            self._select(self._address(offset))
+            data += self._read(chunk)
+            offset += chunk
+            n -= chunk
+        return bytes(data)
+
+    def write_page(self, offset, data):
+        """Write data, which must not cross a page boundary, at offset."""
+        page = offset - offset % self.page_size
+        assert offset + len(data) <= page + self.page_size, (offset, len(data))
+        self._select(self._address(offset) + bytes(data))
+        # Wait for the write cycle to finish.
+        self._select(self._address(offset))
+
+    def write(self, offset, data):
+        """Write data at offset, split at page boundaries."""
+        assert 0 <= offset and offset + len(data) <= self.size, (offset, len(data))
+        end = offset + len(data)
+        while offset < end:
+            page_end = offset - offset % self.page_size + self.page_size
+            n = min(end, page_end) - offset
+            self.write_page(offset, data[:n])
+            data = data[n:]
+            offset += n
+
+    def read_image(self, cls=TOFEAtoms, offset=0):
+        """Read and check the image at offset, reading only its _len bytes."""
+        header_size = cls._len.offset + cls._len.size
+        header = self.read(offset, header_size)
+        if header[:len(cls.MAGIC)] != cls.MAGIC:
+            raise ValueError("Invalid magic %r (expected %r)" % (header[:len(cls.MAGIC)], cls.MAGIC))
+        size = struct.unpack_from("<I", header, cls._len.offset)[0]
+        if offset + header_size + size > self.size:
+            raise ValueError("Length %i larger than EEPROM (%i bytes)" % (size, self.size))
+        return cls.from_buffer(header + self.read(offset + header_size, size))
+
+    def program(self, image, offset=0, verify=True):
+        """Write image at offset, skipping the pages already correct.
+
+        Returns the tofe_diff.Writes done.
+        """
+        assert offset % self.page_size == 0, offset
+        image = tofe_diff._bytes(image)
+        current = self.read(offset, len(image))
+        writes = tofe_diff.plan(current, image, self.page_size)
+        for w in writes:
+            self.write_page(offset + w.offset, w.data)
+        if verify:
+            readback = self.read(offset, len(image))
+            if readback != image:
+                bad = next(i for i in range(0, len(image)) if readback[i] != image[i])
+                raise IOError("Verify failed at 0x%x (read 0x%02x, wrote 0x%02x)" % (
+                    offset + bad, readback[bad], image[bad]))
+        return writes
+
+
+class EEPROMFile(io.RawIOBase):
+    """Unbuffered, seekable file object over an EEPROM.
+
+    Each read() is one sequential read of the EEPROM, so wrapping this in
+    a buffered reader would defeat partial reads.
+
+    >>> e = SimulatedEEPROM(128, 8, data=bytes(range(128)))
+    >>> f = EEPROMFile(e)
+    >>> f.seek(120)
+    120
+    >>> f.read(4), f.seek(2, io.SEEK_CUR), f.read(10), f.read(1)
+    (b'xyz{', 126, b'~\\x7f', b'')
+    """
+
+    def __init__(self, eeprom):
+        io.RawIOBase.__init__(self)
+        self.eeprom = eeprom
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.eeprom.size
+        if offset < 0:
+            raise ValueError("Negative seek position %i" % offset)
+        self._pos = offset
+        return offset
+
+    def readinto(self, b):
+        n = min(len(b), self.eeprom.size - self._pos)
+        if n <= 0:
+            return 0
+        b[:n] = self.eeprom.read(self._pos, n)
+        self._pos += n
+        return n
+
+
+class SimulatedEEPROM(EEPROM):
+    """In memory EEPROM with the timing of a 24LC01B style part.
+
+    Time is simulated in elapsed (seconds), unless realtime is set in which
+    case transfers and write cycles also really take that long.
+
+    >>> from tofe_eeprom import *
+    >>> t = TOFEAtoms.build([
+    ...     AtomProductID.create("tofe.io/milkymist"),
+    ...     AtomProductSerial.create("MM000001"),
+    ...     AtomEEPROMTotalSize.create(0, 128),
+    ... ])
+    >>> e = SimulatedEEPROM(128, 8)
+    >>> len(e.program(t))
+    7
+    >>> t2 = e.read_image()
+    >>> t2.get_atom(1)
+    AtomProductSerial('MM000001')
+    >>> # Programming again only reads back the image.
+    >>> e.transactions = 0
+    >>> len(e.program(t))
+    0
+    >>> e.transactions
+    4
+    >>> e.write(4, b"\\0\\0")
+    >>> e.read(0, 8)
+    b'TOFE\\x00\\x00\\x03\\x02'
+    >>> e.read_image()
+    Traceback (most recent call last):
+        ...
+    ValueError: Invalid version 0x0 (expected 0x1)
+
+    A write running over the end of a page wraps around to its start, as on
+    the real part:
+
+    >>> e.write_page(6, b"abc")
+    Traceback (most recent call last):
+        ...
+    AssertionError: (6, 3)
+    >>> e._select(e._address(6) + b"abc")
+    >>> e.read(0, 8)
+    b'cOFE\\x00\\x00ab'
+
+    Sequential reads and page writes against one transfer per byte:
+
+    >>> def took(f, *args):
+    ...     start = e.elapsed
+    ...     f(*args)
+    ...     return "%.1fms" % ((e.elapsed - start) * 1e3)
+    >>> e = SimulatedEEPROM(128, 8)
+    >>> image = t.as_bytearray()
+    >>> took(e.program, image)
+    '52.3ms'
+    >>> took(e.read_image)
+    '5.1ms'
+    >>> def bytewise_write():
+    ...     for i in range(0, len(image)):
+    ...         e.write(i, image[i:i+1])
+    >>> took(bytewise_write)
+    '277.5ms'
+    >>> def bytewise_read():
+    ...     for i in range(0, len(image)):
+    ...         e.read(i, 1)
+    >>> took(bytewise_read)
+    '20.0ms'
+    """
+
+    def __init__(self, size, page_size, address_bytes=1, clock=100000,
+                 write_cycle=0.005, realtime=False, data=None):
+        EEPROM.__init__(self, size, page_size, address_bytes)
+        self.clock = clock
+        self.write_cycle = write_cycle
+        self.realtime = realtime
+        self.memory = bytearray(b"\xff" * size)
+        if data is not None:
+            self.memory[:len(data)] = data
+        self.pointer = 0
+        self.elapsed = 0.0
+        self.busy_until = 0.0
+        self.transactions = 0
+
+    def _clock(self):
+        return self.elapsed
+
+    def _bus(self, nbytes):
+        # Start, device address and nbytes each with their ack, stop.
+        t = (1 + 9 * (1 + nbytes) + 1) / self.clock
+        self.elapsed += t
+        if self.realtime:
+            time.sleep(t)
+
+    def _write(self, data):
+        self.transactions += 1
+        if self.elapsed < self.busy_until:
+            self._bus(0)
+            return False
+        self._bus(len(data))
+        address = int.from_bytes(data[:self.address_bytes], 'big') % self.size
+        payload = data[self.address_bytes:]
+        page = address - address % self.page_size
+        for i, b in enumerate(payload):
+            self.memory[page + (address - page + i) % self.page_size] = b
+        self.pointer = address
+        if payload:
+            self.busy_until = self.elapsed + self.write_cycle
+            if self.realtime:
+                time.sleep(self.write_cycle)
+        return True
+
+    def _read(self, n):
+        self.transactions += 1
+        self._bus(n)
+        data = bytes(self.memory[(self.pointer + i) % self.size] for i in range(0, n))
+        self.pointer = (self.pointer + n) % self.size
+        return data
+
+
+class LinuxEEPROM(EEPROM):
+    """EEPROM at address on a Linux /dev/i2c-<bus> adapter.
+
+    Parts which use some of the device address bits as memory address
+    (24LC16 and similar) are not supported.
+    """
+
+    I2C_SLAVE = 0x0703
+
+    # Largest message i2c-dev accepts.
+    max_read = 8192
+
+    def __init__(self, bus, address, size, page_size, address_bytes=1):
+        import fcntl
+        EEPROM.__init__(self, size, page_size, address_bytes)
+        self._fd = os.open("/dev/i2c-%i" % bus, os.O_RDWR)
+        fcntl.ioctl(self._fd, self.I2C_SLAVE, address)
+
+    def close(self):
+        os.close(self._fd)
+
+    def _write(self, data):
+        try:
+            os.write(self._fd, data)
+        except OSError as e:
+            # A busy EEPROM does not acknowledge its address.
+            if e.errno in (errno.ENXIO, errno.EREMOTEIO, errno.EIO):
+                return False
+            raise
+        return True
+
+    def _read(self, n):
+        return os.read(self._fd, n)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--bus", type=int, required=True, help="I2C adapter number")
+    parser.add_argument("--address", type=lambda s: int(s, 0), default=0x50,
+                        help="device address (default 0x50)")
+    parser.add_argument("--size", type=int, required=True, help="EEPROM size in bytes")
+    parser.add_argument("--page-size", type=int, required=True, help="page size in bytes")
+    parser.add_argument("--address-bytes", type=int, default=1,
+                        help="memory address bytes (default %(default)s)")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    p = commands.add_parser("read", help="read and check the image")
+    p.add_argument("-o", "--output", help="write the image to this file")
+
+    p = commands.add_parser("program", help="write an image, skipping unchanged pages")
+    p.add_argument("image")
+    p.add_argument("--no-verify", action="store_true", help="do not read back the image")
+
+    args = parser.parse_args(argv)
+
+    e = LinuxEEPROM(args.bus, args.address, args.size, args.page_size, args.address_bytes)
+    try:
+        if args.command == "read":
+            t = e.read_image()
+            if args.output:
+                with open(args.output, "wb") as f:
+                    f.write(t.as_bytearray())
+            else:
+                print(repr(t))
+        else:
+            with open(args.image, "rb") as f:
+                image = f.read()
+            start = time.monotonic()
+            writes = e.program(image, verify=not args.no_verify)
+            print("%i pages written in %.1fms" % (
+                len(writes), (time.monotonic() - start) * 1e3), file=sys.stderr)
+    finally:
+        e.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
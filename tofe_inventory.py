@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set ts=4 sw=4 et sts=4 ai:
+
+"""
+Inventory of TOFE EEPROM dumps in an indexed SQLite database.
+
+Images are parsed once on ingest and their decoded atoms stored by atom
+type, so queries never touch the raw images again.
+
+  ./tofe_inventory.py fleet.db ingest dumps/*.bin
+  ./tofe_inventory.py fleet.db query "PCB Revision" 18b01dd
+  ./tofe_inventory.py fleet.db licenses
+"""
+
+import argparse
+import hashlib
+import sqlite3
+import sys
+
+from tofe_atomview import (
+    VIEWS_TYPES,
+    AtomView,
+    CommentOnView,
+    ExpandIntView,
+    LicenseView,
+    RelativeURLView,
+    SizeOffsetView,
+    URLView,
+    iter_views,
+)
+from tofe_board import ATOMS_BY_NAME
+from tofe_eeprom import (
+    AtomManufacturerID,
+    AtomPCBLicense,
+    AtomProductID,
+    AtomProductSerial,
+)
+from tofe_scan import scan
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id          INTEGER PRIMARY KEY,
+    sha256      TEXT NOT NULL UNIQUE,
+    size        INTEGER NOT NULL,
+    crc8        INTEGER NOT NULL,
+    atoms       INTEGER NOT NULL,
+    raw         BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sources (
+    image_id    INTEGER NOT NULL REFERENCES images(id),
+    source      TEXT NOT NULL,
+    offset      INTEGER NOT NULL,
+    UNIQUE (source, offset)
+);
+-- text:   strings, URLs (relative ones resolved) and license names
+-- number: integers, timestamps, offsets, license values and the index
+--         of relative atoms
+-- size:   size of size/offset atoms
+CREATE TABLE IF NOT EXISTS atoms (
+    image_id    INTEGER NOT NULL REFERENCES images(id),
+    idx         INTEGER NOT NULL,
+    type        INTEGER NOT NULL,
+    text        TEXT,
+    number      INTEGER,
+    size        INTEGER,
+    PRIMARY KEY (image_id, idx)
+);
+CREATE INDEX IF NOT EXISTS sources_image ON sources (image_id);
+CREATE INDEX IF NOT EXISTS atoms_type_text ON atoms (type, text);
+CREATE INDEX IF NOT EXISTS atoms_type_number ON atoms (type, number);
+"""
+
+
+def connect(path):
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA)
+    return db
+
+
+def _columns(view, views):
+    """Return (text, number, size) to store for an atom view.
+
+    Raises ValueError for values which can not be decoded.
+    """
+    if isinstance(view, RelativeURLView):
+        if view.index >= len(views):
+            raise ValueError("%s index %i out of range (%i atoms)" % (
+                view.name, view.index, len(views)))
+        text = view.str
+        # Comments on an atom are not relative URLs, even though they have
+        # the same layout.
+        if not isinstance(view, CommentOnView) and isinstance(views[view.index], URLView):
+            text = "%s/%s" % (views[view.index].url, text)
+        return text, view.index, None
+    if isinstance(view, SizeOffsetView):
+        return None, view.offset, view.size
+    if isinstance(view, LicenseView):
+        return view.license.name, view.license.value, None
+    value = view.value
+    if isinstance(value, int):
+        return None, value, None
+    if isinstance(value, bytes):
+        return value.hex(), None, None
+    return value, None, None
+
+
+def add_image(db, image, source, offset=0):
+    """Store a parsed TOFEAtoms image, returning whether it was new.
+
+    Raises ValueError, before anything is stored, if an atom can not be
+    decoded.
+    """
+    raw = bytes(image.as_bytearray())
+    sha = hashlib.sha256(raw).hexdigest()
+    row = db.execute("SELECT id FROM images WHERE sha256 = ?", (sha,)).fetchone()
+    new = row is None
+    if new:
+        views = list(iter_views(raw))
+        columns = [(i, v.type) + _columns(v, views) for i, v in enumerate(views)]
+        image_id = db.execute(
+            "INSERT INTO images (sha256, size, crc8, atoms, raw) VALUES (?, ?, ?, ?, ?)",
+            (sha, len(raw), image.crc8, image.atoms, raw)).lastrowid
+        db.executemany(
+            "INSERT INTO atoms (image_id, idx, type, text, number, size) VALUES (?, ?, ?, ?, ?, ?)",
+            [(image_id,) + c for c in columns])
+    else:
+        image_id = row[0]
+    db.execute(
+        "INSERT OR IGNORE INTO sources (image_id, source, offset) VALUES (?, ?, ?)",
+        (image_id, source, offset))
+    return new
+
+
+def ingest(db, f, source):
+    """Add every valid image found in the file object f.
+
+    Returns (new, duplicate, rejected) counts. Images with a bad CRC or
+    structure, or with atoms which can not be decoded, are rejected.
+
+    >>> import io
+    >>> from tofe_eeprom import *
+    >>> db = connect(":memory:")
+    >>> def board(serial):
+    ...     return TOFEAtoms.build([
+    ...         AtomManufacturerID.create("numato.com"),
+    ...         AtomProductID.create("tofe.io/lowspeedio"),
+    ...         AtomProductSerial.create(serial),
+    ...         AtomPCBRepository.create(1, "r/pcb.git"),
+    ...         AtomPCBRevision.create("18b01dd"),
+    ...         AtomPCBLicense.create(AtomPCBLicense.Names.CC_BY_SA_v40),
+    ...         AtomEEPROMTotalSize.create(0, 16*1024),
+    ...     ]).as_bytearray()
+    >>> dump = board("LS01") + b"junk" + board("LS02") + board("LS01")
+    >>> ingest(db, io.BytesIO(dump), "dump.bin")
+    (2, 1, 0)
+    >>> for row in find(db, AtomPCBRevision.TYPE, "18b01dd"):
+    ...     print(row)
+    (1, 'https://numato.com', 'https://tofe.io/lowspeedio', 'LS01', 'dump.bin')
+    (2, 'https://numato.com', 'https://tofe.io/lowspeedio', 'LS02', 'dump.bin')
+    >>> find(db, AtomPCBRepository.TYPE, "https://tofe.io/lowspeedio/r/pcb.git")[0][0]
+    1
+    >>> find(db, AtomEEPROMTotalSize.TYPE, 0)[0][0]
+    1
+    >>> licenses_by_manufacturer(db)
+    [('https://numato.com', 'CC_BY_SA_v40', 2)]
+
+    Comments on an atom keep their own text, whatever atom they are on:
+
+    >>> note = TOFEAtoms.build([
+    ...     AtomProductID.create("tofe.io/x"),
+    ...     AtomCommentOn.create(0, "hello"),
+    ...     AtomCompressedCommentOn.create(0, "Enable the LED"),
+    ... ]).as_bytearray()
+    >>> ingest(db, io.BytesIO(note), "note.bin")
+    (1, 0, 0)
+    >>> db.execute("SELECT text, number FROM atoms WHERE image_id = 3 AND idx > 0").fetchall()
+    [('hello', 0), ('Enable the LED', 0)]
+
+    Images with valid CRCs but atoms which do not decode are rejected on
+    their own:
+
+    >>> from tofe_atomview import views
+    >>> bad_license, bad_index = board("LS03"), board("LS04")
+    >>> views(bad_license)[5].data[0] = 7
+    >>> views(bad_index)[3].index = 9
+    >>> for b in (bad_license, bad_index):
+    ...     TOFEAtoms.from_buffer(b, check=False).crc_update()
+    >>> dump = bad_license + board("LS05") + bad_index
+    >>> ingest(db, io.BytesIO(dump), "bad.bin")
+    (1, 0, 2)
+    >>> [row[3] for row in find(db, AtomPCBRevision.TYPE, "18b01dd")]
+    ['LS01', 'LS02', 'LS05']
+    """
+    counts = [0, 0, 0]
+    for r in scan(f):
+        if r.error:
+            counts[2] += 1
+            continue
+        try:
+            new = add_image(db, r.image, source, r.offset)
+        except ValueError:
+            counts[2] += 1
+            continue
+        if new:
+            counts[0] += 1
+        else:
+            counts[1] += 1
+    db.commit()
+    return tuple(counts)
+
+
+def is_numeric(atom_type):
+    """Whether atoms of atom_type are matched on the number column."""
+    return issubclass(VIEWS_TYPES.get(atom_type, AtomView), (ExpandIntView, SizeOffsetView))
+
+
+def _atom_text(atom_type):
+    return "MAX(CASE WHEN atoms.type = %i THEN atoms.text END)" % atom_type
+
+
+def find(db, atom_type, value):
+    """Return the images with an atom of atom_type matching value.
+
+    Rows are (image id, manufacturer, product, serial, first source).
+    """
+    column = "number" if is_numeric(atom_type) else "text"
+    return db.execute(
+        """SELECT atoms.image_id, %s, %s, %s,
+                  (SELECT source FROM sources WHERE image_id = atoms.image_id
+                   ORDER BY rowid LIMIT 1)
+           FROM atoms
+           WHERE atoms.image_id IN (SELECT image_id FROM atoms WHERE type = ? AND %s = ?)
+           GROUP BY atoms.image_id
+           ORDER BY atoms.image_id""" % (
+            _atom_text(AtomManufacturerID.TYPE),
+            _atom_text(AtomProductID.TYPE),
+            _atom_text(AtomProductSerial.TYPE),
+            column),
+        (atom_type, value)).fetchall()
+
+
+def licenses_by_manufacturer(db):
+    """Return (manufacturer, PCB license, images) rows."""
+    return db.execute(
+        """SELECT m.text, l.text, COUNT(*)
+           FROM atoms AS l JOIN atoms AS m
+               ON m.image_id = l.image_id AND m.type = ?
+           WHERE l.type = ?
+           GROUP BY m.text, l.text
+           ORDER BY m.text, l.text""",
+        (AtomManufacturerID.TYPE, AtomPCBLicense.TYPE)).fetchall()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("db", help="inventory database file")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    p = commands.add_parser("ingest", help="add the images found in dump files")
+    p.add_argument("files", nargs="+")
+
+    p = commands.add_parser("query", help="find images by atom value")
+    p.add_argument("atom", help="atom name, for example 'PCB Revision'")
+    p.add_argument("value")
+
+    commands.add_parser("licenses", help="count PCB licenses by manufacturer")
+
+    args = parser.parse_args(argv)
+    db = connect(args.db)
+
+    if args.command == "ingest":
+        for filename in args.files:
+            with open(filename, "rb") as f:
+                new, duplicate, rejected = ingest(db, f, filename)
+            print("%s: %i new, %i duplicate, %i rejected" % (filename, new, duplicate, rejected))
+    elif args.command == "query":
+        if args.atom not in ATOMS_BY_NAME:
+            parser.error("unknown atom %r" % args.atom)
+        atom_type = ATOMS_BY_NAME[args.atom].TYPE
+        value = args.value
+        if is_numeric(atom_type):
+            value = int(value, 0)
+        for row in find(db, atom_type, value):
+            print("%i\t%s\t%s\t%s\t%s" % row)
+    else:
+        for row in licenses_by_manufacturer(db):
+            print("%s\t%s\t%i" % row)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
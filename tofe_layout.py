@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set ts=4 sw=4 et sts=4 ai:
+
+"""
+Check the EEPROM memory map described by the size/offset atoms of an image.
+
+The EEPROM Total Size atom gives the extent of the part, the Vendor Data,
+TOFE Data, User Data, GUID, Hole and GUID Write atoms describe regions
+inside it. The regions are flattened into sorted, non-overlapping segments
+each listing the regions covering it, so any byte offset is mapped to its
+regions with a binary search.
+
+  ./tofe_layout.py milkymist_eeprom.bit --lookup 0x700
+"""
+
+import argparse
+import bisect
+import collections
+import sys
+
+from tofe_atomview import SizeOffsetView, iter_views
+from tofe_eeprom import ATOMS, ATOMS_TYPES, AtomEEPROMTotalSize, TOFEAtoms
+
+# end is exclusive, index is the index of the atom in the image.
+Region = collections.namedtuple("Region", "start end name index")
+
+
+def regions(image, cls=TOFEAtoms):
+    """Return (total, regions) from the size/offset atoms of image.
+
+    total is the EEPROM Total Size region, or None if the image has none.
+    """
+    if isinstance(image, TOFEAtoms):
+        image = image.as_bytearray()
+    total = None
+    found = []
+    for i, view in enumerate(iter_views(image, cls)):
+        if not isinstance(view, SizeOffsetView):
+            continue
+        offset, size = view.value
+        name = ATOMS[ATOMS_TYPES[view.type].ORDER][0]
+        region = Region(offset, offset + size, name, i)
+        if view.type == AtomEEPROMTotalSize.TYPE:
+            if total is not None:
+                raise ValueError("Multiple EEPROM Total Size atoms (%i and %i)" % (total.index, i))
+            total = region
+        else:
+            found.append(region)
+    return total, found
+
+
+class Layout(object):
+    """Interval index over the regions of an EEPROM.
+
+    >>> from tofe_eeprom import *
+    >>> t = TOFEAtoms.build([
+    ...     AtomEEPROMTotalSize.create(0, 4096),
+    ...     AtomEEPROMVendorData.create(1536, 256),
+    ...     AtomEEPROMTOFEData.create(0, 1024),
+    ...     AtomEEPROMUserData.create(1024, 256),
+    ...     AtomEEPROMGUID.create(1784, 16),
+    ...     AtomEEPROMHole.create(4000, 200),
+    ... ])
+    >>> layout = Layout.from_image(t)
+    >>> layout.lookup(0x6fc)
+    (Region(start=1536, end=1792, name='EEPROM Vendor Data', index=1), Region(start=1784, end=1800, name='EEPROM GUID', index=4))
+    >>> layout.lookup(1300)
+    ()
+    >>> [r.name for r in layout.lookup(1023) + layout.lookup(1024)]
+    ['EEPROM TOFE Data', 'EEPROM User Data']
+    >>> layout.gaps()
+    [(1280, 1536), (1800, 4000)]
+    >>> for problem in layout.problems():
+    ...     print(problem)
+    EEPROM Vendor Data (0x600-0x700) overlaps EEPROM GUID (0x6f8-0x708)
+    EEPROM Hole (0xfa0-0x1068) extends past EEPROM Total Size (0x0-0x1000)
+    """
+
+    def __init__(self, regions, total=None):
+        self.regions = sorted(regions)
+        self.total = total
+
+        # Segment i covers [_starts[i], _starts[i+1]) and is owned by
+        # _owners[i], a tuple of regions sorted by start.
+        edges = sorted(set(
+            [r.start for r in self.regions if r.end > r.start] +
+            [r.end for r in self.regions if r.end > r.start]))
+        self._starts = edges
+        self._owners = []
+        for start in edges:
+            self._owners.append(tuple(
+                r for r in self.regions if r.start <= start < r.end))
+
+    @classmethod
+    def from_image(cls, image, atoms_cls=TOFEAtoms):
+        total, found = regions(image, atoms_cls)
+        return cls(found, total)
+
+    def lookup(self, offset):
+        """Return the regions containing the byte at offset."""
+        i = bisect.bisect_right(self._starts, offset) - 1
+        if i < 0:
+            return ()
+        return self._owners[i]
+
+    def overlaps(self):
+        """Return the pairs of regions which overlap."""
+        pairs = []
+        active = []
+        for r in self.regions:
+            if r.end <= r.start:
+                continue
+            active = [a for a in active if a.end > r.start]
+            pairs.extend((a, r) for a in active)
+            active.append(r)
+        return pairs
+
+    def gaps(self):
+        """Return the (start, end) ranges of the EEPROM not in any region."""
+        if self.total is None:
+            return []
+        gaps = []
+        pos = self.total.start
+        for start, owners in zip(self._starts, self._owners):
+            if start >= self.total.end:
+                break
+            if owners:
+                if start > pos:
+                    gaps.append((pos, start))
+                pos = max(pos, max(r.end for r in owners))
+        if pos < self.total.end:
+            gaps.append((pos, self.total.end))
+        return gaps
+
+    def out_of_bounds(self):
+        """Return the regions not inside the EEPROM Total Size region."""
+        if self.total is None:
+            return []
+        return [r for r in self.regions
+                if r.start < self.total.start or r.end > self.total.end]
+
+    def problems(self):
+        """Return descriptions of the overlapping and out of bounds regions."""
+        def fmt(r):
+            return "%s (0x%x-0x%x)" % (r.name, r.start, r.end)
+        problems = []
+        if self.total is None and self.regions:
+            problems.append("No EEPROM Total Size atom")
+        for a, b in self.overlaps():
+            problems.append("%s overlaps %s" % (fmt(a), fmt(b)))
+        for r in self.out_of_bounds():
+            problems.append("%s extends past EEPROM Total Size (0x%x-0x%x)" % (
+                fmt(r), self.total.start, self.total.end))
+        return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("image", help="EEPROM image file")
+    parser.add_argument("--lookup", metavar="OFFSET", action="append", default=[],
+                        type=lambda s: int(s, 0), help="print the regions containing OFFSET")
+    args = parser.parse_args(argv)
+
+    layout = Layout.from_image(TOFEAtoms.from_file(args.image))
+
+    for offset in args.lookup:
+        owners = layout.lookup(offset)
+        print("0x%x: %s" % (offset, ", ".join(r.name for r in owners) or "-"))
+    if args.lookup:
+        return 0
+
+    for r in layout.regions:
+        print("0x%06x-0x%06x %s" % (r.start, r.end, r.name))
+    for start, end in layout.gaps():
+        print("0x%06x-0x%06x (unused)" % (start, end))
+    problems = layout.problems()
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
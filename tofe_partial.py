@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set ts=4 sw=4 et sts=4 ai:
+
+"""
+Read only the header and selected atoms of a TOFE EEPROM image.
+
+The atom headers (type and length) are walked through a seekable file
+object, fetching just the payloads of the wanted atom types and seeking
+over the rest. Atoms are stored in ORDER, so the walk stops after the last
+atom which could be wanted. Works with files and, through
+tofe_i2c.EEPROMFile, directly on an EEPROM.
+
+The image CRC is not checked, as that needs the whole image.
+
+>>> from tofe_eeprom import *
+>>> from tofe_i2c import EEPROMFile, SimulatedEEPROM
+>>> t = TOFEAtoms.build([
+...     AtomManufacturerID.create("numato.com"),
+...     AtomProductID.create("tofe.io/lowspeedio"),
+...     AtomProductSerial.create("LS000042"),
+...     AtomEEPROMTotalSize.create(0, 16384),
+...     AtomComment.create("ADC registers " * 15),
+... ])
+>>> e = SimulatedEEPROM(16384, 64, 2, clock=400000)
+>>> _ = e.program(t)
+>>> f = EEPROMFile(e)
+>>> start = e.elapsed
+>>> for i, view in read_atoms(f, [AtomProductID, AtomProductSerial]):
+...     print(i, view)
+1 AtomProductID('https://tofe.io/lowspeedio')
+2 AtomProductSerial('LS000042')
+>>> "%.2fms" % ((e.elapsed - start) * 1e3)
+'1.74ms'
+>>> start = e.elapsed
+>>> _ = e.read_image()
+>>> "%.2fms" % ((e.elapsed - start) * 1e3)
+'6.43ms'
+"""
+
+import collections
+import io
+import struct
+
+from tofe_atomview import atom_view
+from tofe_eeprom import ATOMS_TYPES, TOFEAtoms
+
+Header = collections.namedtuple("Header", "version atoms crc8 len")
+
+
+def read_header(f, cls=TOFEAtoms):
+    r"""Read and check the header at the current position of f.
+
+    >>> from tofe_eeprom import *
+    >>> image = TOFEAtoms.build([AtomProductSerial.create("1")]).as_bytearray()
+    >>> read_header(io.BytesIO(image))
+    Header(version=1, atoms=1, crc8=246, len=8)
+    >>> read_header(io.BytesIO(b"TOFE\0\2"))
+    Traceback (most recent call last):
+        ...
+    ValueError: Truncated header (6 of 12 bytes)
+    """
+    size = cls._len.offset + cls._len.size
+    header = f.read(size)
+    if len(header) < size:
+        raise ValueError("Truncated header (%i of %i bytes)" % (len(header), size))
+    magic = header[:len(cls.MAGIC)]
+    if magic != cls.MAGIC:
+        raise ValueError("Invalid magic %r (expected %r)" % (magic, cls.MAGIC))
+    h = Header(
+        header[cls.version.offset],
+        header[cls.atoms.offset],
+        header[cls.crc8.offset],
+        struct.unpack_from("<I", header, cls._len.offset)[0])
+    if h.version != cls.VERSION:
+        raise ValueError("Invalid version 0x%x (expected 0x%x)" % (h.version, cls.VERSION))
+    return h
+
+
+def read_atoms(f, atom_types, cls=TOFEAtoms):
+    r"""Return (index, view) for the atoms of the wanted types in the image
+    at the current position of f.
+
+    atom_types are atom classes or type numbers. f is left positioned
+    after the last atom read.
+
+    >>> from tofe_eeprom import *
+    >>> image = TOFEAtoms.build([
+    ...     AtomProductID.create("tofe.io/milkymist"),
+    ...     AtomEEPROMVendorData.create(0x600, 256),
+    ...     AtomEEPROMVendorData.create(0x800, 2),
+    ...     AtomComment.create("Thanks for backing!"),
+    ... ]).as_bytearray()
+    >>> read_atoms(io.BytesIO(image), [AtomEEPROMVendorData])
+    [(1, AtomEEPROMVendorData(0x600, 0x100)), (2, AtomEEPROMVendorData(0x800, 0x2))]
+    >>> read_atoms(io.BytesIO(image), [AtomComment.TYPE, 0x99])
+    [(3, AtomComment('Thanks for backing!'))]
+    >>> read_atoms(io.BytesIO(image[:40]), [AtomComment])
+    Traceback (most recent call last):
+        ...
+    ValueError: Truncated atom 3
+    """
+    wanted = set(getattr(t, "TYPE", t) for t in atom_types)
+    last_order = max(
+        (ATOMS_TYPES[t].ORDER for t in wanted if t in ATOMS_TYPES), default=None)
+    if any(t not in ATOMS_TYPES for t in wanted):
+        last_order = None
+
+    header = read_header(f, cls)
+    end = f.tell() + header.len
+
+    found = []
+    for i in range(0, header.atoms):
+        atom_header = f.read(2)
+        if len(atom_header) < 2:
+            raise ValueError("Truncated atom %i" % i)
+        atom_type, size = atom_header
+        if f.tell() + size > end:
+            raise ValueError("Atom %i overruns image" % i)
+        atom_cls = ATOMS_TYPES.get(atom_type)
+        if last_order is not None and atom_cls is not None and atom_cls.ORDER > last_order:
+            break
+        if atom_type not in wanted:
+            f.seek(size, io.SEEK_CUR)
+            continue
+        data = f.read(size)
+        if len(data) < size:
+            raise ValueError("Truncated atom %i" % i)
+        found.append((i, atom_view(atom_header + data)))
+    return found
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set ts=4 sw=4 et sts=4 ai:
+
+"""
+Mass provisioning of TOFE EEPROM images for the production line.
+
+Every board gets the same template image with a unique Product Serial and
+PCB Production Batch ID. The template is serialized once, per unit only the
+serial / batch atoms are encoded and the CRC is derived from the CRCs of the
+fixed parts which were calculated up front.
+
+  ./tofe_provision.py milkymist_eeprom.bit --count 100000 \\
+      --serial-format 'MM%06i' --out milkymist_images.bin
+"""
+
+import argparse
+import ctypes
+import os
+import struct
+import sys
+import time
+
+import tofe_crc8
+from tofe_eeprom import (
+    AtomCommentOn,
+    AtomFormatExpandInt,
+    AtomFormatRelativeURL,
+    AtomPCBProductionBatchID,
+    AtomProductSerial,
+    TOFEAtoms,
+)
+
+
+class Provisioner(object):
+    r"""
+    Produce images from a template with the slots atoms replaced per unit.
+
+    Slot atoms missing from the template are inserted at the position their
+    ORDER requires and the indexes of relative atoms are adjusted to match.
+
+    >>> from tofe_eeprom import *
+    >>> template = TOFEAtoms.build([
+    ...     AtomManufacturerID.create("numato.com"),
+    ...     AtomProductID.create("tofe.io/milkymist"),
+    ...     AtomPCBRepository.create(1, "r/pcb.git"),
+    ...     AtomEEPROMTotalSize.create(0, 128),
+    ... ])
+    >>> p = Provisioner(template)
+    >>> image = p.image("MM000001", 1450787283)
+    >>> t = TOFEAtoms.from_buffer(bytearray(image))
+    >>> for a in t.iter_atoms():
+    ...     print(repr(a))
+    AtomManufacturerID('https://numato.com')
+    AtomProductID('https://tofe.io/milkymist')
+    AtomProductSerial('MM000001')
+    AtomPCBRepository('https://tofe.io/milkymist/r/pcb.git')
+    AtomPCBProductionBatchID(1450787283)
+    AtomEEPROMTotalSize(0x0, 0x80)
+    >>> image == bytes(TOFEAtoms.build([
+    ...     AtomManufacturerID.create("numato.com"),
+    ...     AtomProductID.create("tofe.io/milkymist"),
+    ...     AtomProductSerial.create("MM000001"),
+    ...     AtomPCBRepository.create(1, "r/pcb.git"),
+    ...     AtomPCBProductionBatchID.create(1450787283),
+    ...     AtomEEPROMTotalSize.create(0, 128),
+    ... ]).as_bytearray())
+    True
+
+    >>> # Same sized slots patch a copy of the previous image.
+    >>> image2 = p.image("MM000002", 1450787283)
+    >>> TOFEAtoms.from_buffer(bytearray(image2)).get_atom(2)
+    AtomProductSerial('MM000002')
+    >>> # Different sizes rebuild it.
+    >>> image3 = p.image("MM1000000", 1450787283)
+    >>> TOFEAtoms.from_buffer(bytearray(image3)).get_atom(2)
+    AtomProductSerial('MM1000000')
+    """
+
+    def __init__(self, template, slots=(AtomProductSerial, AtomPCBProductionBatchID)):
+        self.cls = template.__class__
+        self.slots = tuple(slots)
+
+        # Entries are either raw atom bytes or the index of a slot.
+        layout = []
+        for atom in template.iter_atoms():
+            if atom.__class__ in self.slots:
+                slot = self.slots.index(atom.__class__)
+                if slot in layout:
+                    raise ValueError("Template has multiple %s atoms" % atom.__class__.__name__)
+                layout.append(slot)
+            else:
+                layout.append((atom, atom.as_bytearray()))
+
+        # Old atom index -> new atom index after inserting the missing slots.
+        remap = list(range(0, len(layout)))
+        for slot, slot_cls in sorted(enumerate(self.slots), key=lambda x: x[1].ORDER):
+            if slot in layout:
+                continue
+            pos = 0
+            for i, entry in enumerate(layout):
+                if isinstance(entry, int):
+                    order = self.slots[entry].ORDER
+                else:
+                    order = entry[0].ORDER
+                if order <= slot_cls.ORDER:
+                    pos = i+1
+            layout.insert(pos, slot)
+            remap = [(j+1 if j >= pos else j) for j in remap]
+
+        # Group the fixed atoms between slots into segments.
+        self._segments = [bytearray()]
+        self._slot_order = []
+        for entry in layout:
+            if isinstance(entry, int):
+                self._slot_order.append(entry)
+                self._segments.append(bytearray())
+                continue
+            atom, raw = entry
+            if isinstance(atom, (AtomFormatRelativeURL, AtomCommentOn)):
+                raw[atom.__class__.index.offset] = remap[atom.index]
+            self._segments[-1].extend(raw)
+        self._segments[-1].extend(self.cls.RAGIC)
+        self._segments = [bytes(s) for s in self._segments]
+        self._segments_crc = [tofe_crc8.crc8(s) for s in self._segments]
+
+        self.atoms = len(layout)
+        self._fixed_len = sum(len(s) for s in self._segments)
+
+        header = bytearray(template.as_bytearray()[:ctypes.sizeof(self.cls)])
+        header[self.cls.atoms.offset] = self.atoms
+        self._header = header
+
+        self._last_sizes = None
+        self._last_image = None
+        self._last_offsets = None
+        self._last_encoded = [None] * len(self.slots)
+
+    def _encode(self, slot, value):
+        # Consecutive units usually share values (the batch), reuse those.
+        last = self._last_encoded[slot]
+        if last is not None and last[0] == value:
+            return last[1]
+        slot_cls = self.slots[slot]
+        if issubclass(slot_cls, AtomFormatExpandInt):
+            encoded = slot_cls.encode_many([value])[0]
+        else:
+            encoded = bytes(slot_cls.create(value)._raw())
+        self._last_encoded[slot] = (value, encoded)
+        return encoded
+
+    def image(self, *values):
+        """Return the image bytes with the slot atoms set to values."""
+        assert len(values) == len(self.slots), values
+        parts = [self._encode(slot, values[slot]) for slot in self._slot_order]
+        sizes = [len(p) for p in parts]
+
+        if sizes != self._last_sizes:
+            header = bytearray(self._header)
+            struct.pack_into(
+                "<I", header, self.cls._len.offset, self._fixed_len + sum(sizes))
+            chunks = [header, self._segments[0]]
+            offsets = []
+            offset = len(header) + len(self._segments[0])
+            for part, segment in zip(parts, self._segments[1:]):
+                offsets.append(offset)
+                offset += len(part) + len(segment)
+                chunks.append(part)
+                chunks.append(segment)
+            image = bytearray().join(chunks)
+            self._last_sizes = sizes
+            self._last_offsets = offsets
+            self._last_image = image
+        else:
+            image = bytearray(self._last_image)
+            for offset, part in zip(self._last_offsets, parts):
+                image[offset:offset+len(part)] = part
+
+        crc_offset = self.cls.crc8.offset
+        crc = tofe_crc8.crc8_skip(memoryview(image)[:len(self._header)], crc_offset)
+        crc = tofe_crc8.crc8_combine(crc, self._segments_crc[0], len(self._segments[0]))
+        for part, segment, segment_crc in zip(parts, self._segments[1:], self._segments_crc[1:]):
+            crc = tofe_crc8.crc8(part, crc)
+            crc = tofe_crc8.crc8_combine(crc, segment_crc, len(segment))
+        image[crc_offset] = crc
+        return bytes(image)
+
+
+def provision(provisioner, serials, batch):
+    """Yield (serial, image) for each serial."""
+    for serial in serials:
+        yield serial, provisioner.image(serial, batch)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("template", help="template image file")
+    parser.add_argument("--count", type=int, required=True, help="number of images")
+    parser.add_argument("--start", type=int, default=0, help="first serial number")
+    parser.add_argument("--serial-format", default="%08i", help="printf format for the serial")
+    parser.add_argument("--batch", type=int, default=None,
+                        help="PCB Production Batch ID timestamp (default now)")
+    out = parser.add_mutually_exclusive_group(required=True)
+    out.add_argument("--out-dir", help="write one <serial>.bit file per image")
+    out.add_argument("--out", help="write all images concatenated into one file")
+    args = parser.parse_args(argv)
+
+    batch = args.batch
+    if batch is None:
+        batch = int(time.time())
+
+    template = TOFEAtoms.from_file(args.template)
+    provisioner = Provisioner(template)
+    serials = (args.serial_format % i for i in range(args.start, args.start+args.count))
+
+    start = time.time()
+    count = 0
+    total = 0
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+        for serial, image in provision(provisioner, serials, batch):
+            if os.sep in serial:
+                raise ValueError("Serial %r can not be used as a filename" % serial)
+            with open(os.path.join(args.out_dir, serial + ".bit"), "wb") as f:
+                f.write(image)
+            count += 1
+            total += len(image)
+    else:
+        with open(args.out, "wb") as f:
+            for serial, image in provision(provisioner, serials, batch):
+                f.write(image)
+                count += 1
+                total += len(image)
+    elapsed = time.time() - start
+
+    print("Wrote %i images (%i bytes) in %.3fs, %.0f images/s" % (
+        count, total, elapsed, count / elapsed if elapsed else float('inf')),
+        file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set ts=4 sw=4 et sts=4 ai:
+
+"""
+Scan raw EEPROM capture files for TOFE images.
+
+Captures can hold many images back to back with garbage between them. The
+file is read through a fixed size window, so memory use is bounded by the
+window plus the largest image accepted whatever the size of the file. After
+a corrupt image scanning continues from the byte after its magic.
+
+  ./tofe_scan.py capture.bin --extract images/
+"""
+
+import argparse
+import collections
+import ctypes
+import os
+import struct
+import sys
+
+from tofe_eeprom import TOFEAtoms
+
+ScanResult = collections.namedtuple("ScanResult", "offset image error")
+
+
+def scan(f, cls=TOFEAtoms, window=1 << 20, max_size=1 << 16):
+    r"""Yield a ScanResult for every magic found in the file object f.
+
+    image is the parsed (copied) image, or None with error set to why the
+    candidate was rejected.
+
+    >>> import io
+    >>> from tofe_eeprom import *
+    >>> image = bytes(TOFEAtoms.build([AtomProductID.create("tofe.io/milkymist")]).as_bytearray())
+    >>> bad = bytearray(image)
+    >>> bad[20] ^= 0xff
+    >>> capture = b"junk" + image + bytes(bad) + b"\xff" * 7 + image + image[:20]
+    >>> for r in scan(io.BytesIO(capture), window=16):
+    ...     print(r.offset, r.image and r.image.get_atom(0), r.error)
+    4 AtomProductID('https://tofe.io/milkymist') None
+    40 None Invalid crc8 0x6d (calculated 0x94)
+    83 AtomProductID('https://tofe.io/milkymist') None
+    119 None Truncated image (20 of 36 bytes)
+    """
+    magic = cls.MAGIC
+    header_size = ctypes.sizeof(cls)
+    len_offset = cls._len.offset
+
+    buf = bytearray()
+    base = 0    # File offset of buf[0]
+    pos = 0     # Where to search from in buf
+    eof = False
+
+    def fill(n):
+        nonlocal eof
+        while len(buf) < n and not eof:
+            chunk = f.read(max(window, n - len(buf)))
+            if not chunk:
+                eof = True
+            buf.extend(chunk)
+        return len(buf) >= n
+
+    while True:
+        i = buf.find(magic, pos)
+        if i < 0:
+            if eof:
+                return
+            # Keep what could be the start of a magic split over windows.
+            keep = max(pos, len(buf) - (len(magic) - 1))
+            del buf[:keep]
+            base += keep
+            pos = 0
+            fill(len(buf) + window)
+            continue
+
+        del buf[:i]
+        base += i
+        pos = 1
+
+        if not fill(header_size):
+            yield ScanResult(base, None, "Truncated header (%i of %i bytes)" % (len(buf), header_size))
+            continue
+
+        size = header_size + struct.unpack_from("<I", buf, len_offset)[0]
+        if size > max_size:
+            yield ScanResult(base, None, "Image size %i larger than %i" % (size, max_size))
+            continue
+        if not fill(size):
+            yield ScanResult(base, None, "Truncated image (%i of %i bytes)" % (len(buf), size))
+            continue
+
+        try:
+            image = cls.from_buffer(bytearray(buf[:size]))
+        except ValueError as e:
+            yield ScanResult(base, None, str(e))
+            continue
+        yield ScanResult(base, image, None)
+        pos = size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("capture", help="raw capture file")
+    parser.add_argument("--window", type=int, default=1 << 20,
+                        help="read window in bytes (default %(default)s)")
+    parser.add_argument("--max-size", type=int, default=1 << 16,
+                        help="largest image accepted (default %(default)s)")
+    parser.add_argument("--extract", metavar="DIR",
+                        help="write valid images to DIR/<offset>.bit")
+    args = parser.parse_args(argv)
+
+    if args.extract:
+        os.makedirs(args.extract, exist_ok=True)
+
+    good = 0
+    bad = 0
+    with open(args.capture, "rb") as f:
+        for r in scan(f, window=args.window, max_size=args.max_size):
+            if r.error:
+                bad += 1
+                print("0x%08x bad: %s" % (r.offset, r.error))
+                continue
+            good += 1
+            print("0x%08x ok: %i bytes, %i atoms, crc8 0x%02x" % (
+                r.offset, r.image._size, r.image.atoms, r.image.crc8))
+            if args.extract:
+                with open(os.path.join(args.extract, "%08x.bit" % r.offset), "wb") as out:
+                    out.write(r.image.as_bytearray())
+
+    print("%i images, %i rejected" % (good, bad), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set ts=4 sw=4 et sts=4 ai:
+
+"""
+Program TOFE EEPROMs on several I2C adapters at the same time.
+
+Each device has its own queue of images and a worker which writes the
+changed pages, reads the image back and checks it. An attempt which fails
+with an I/O error or times out is retried from the start, the pages already
+written are then skipped. Any other error fails the job at once.
+
+Devices are async objects with size, page_size, read() and write_page().
+ThreadedDevice runs a blocking tofe_i2c.EEPROM in its own thread and
+SimulatedDevice sleeps for the bus time of a tofe_i2c.SimulatedEEPROM.
+
+>>> import asyncio
+>>> from tofe_eeprom import *
+>>> from tofe_i2c import SimulatedEEPROM
+>>> images = [TOFEAtoms.build([AtomProductSerial.create("MM%06i" % i)]) for i in range(0, 8)]
+>>> devices = [SimulatedDevice(SimulatedEEPROM(128, 8)) for i in range(0, 4)]
+>>> jobs = [(i % 4, image) for i, image in enumerate(images)]
+>>> results = asyncio.run(Station(devices).run(jobs))
+>>> [(r.job, r.device, r.attempts, r.pages, r.error) for r in results[:5]]
+[(0, 0, 1, 4, None), (1, 1, 1, 4, None), (2, 2, 1, 4, None), (3, 3, 1, 4, None), (4, 0, 1, 2, None)]
+>>> t = devices[1].eeprom.read_image()
+>>> t.get_atom(0)
+AtomProductSerial('MM000005')
+
+The devices work concurrently, all four have an operation in flight at once:
+
+>>> active = [0, 0]
+>>> class CountedDevice(SimulatedDevice):
+...     async def _run(self, f, *args):
+...         active[0] += 1
+...         active[1] = max(active)
+...         try:
+...             return await super()._run(f, *args)
+...         finally:
+...             active[0] -= 1
+>>> devices = [CountedDevice(SimulatedEEPROM(128, 8), time_scale=0) for i in range(0, 4)]
+>>> results = asyncio.run(Station(devices).run(jobs))
+>>> active
+[0, 4]
+
+Transfer errors are retried and hung devices time out:
+
+>>> flaky = SimulatedDevice(SimulatedEEPROM(128, 8), time_scale=0, error_rate=0.1, seed=3)
+>>> results = asyncio.run(Station([flaky], retries=5).run([(0, image) for image in images]))
+>>> [r.attempts for r in results], [r.error for r in results if r.error]
+([3, 1, 1, 1, 3, 1, 1, 2], [])
+>>> hung = SimulatedDevice(SimulatedEEPROM(128, 8), delay=1)
+>>> asyncio.run(Station([hung], retries=1, timeout=0.01).run([(0, images[0])]))
+[Result(job=0, device=0, attempts=2, pages=0, error='TimeoutError()')]
+
+Images larger than the EEPROM are not attempted, and any other error fails
+the job without a retry rather than stopping its device:
+
+>>> big = TOFEAtoms.build([AtomComment.create("x" * 200)] * 2)
+>>> small = SimulatedDevice(SimulatedEEPROM(128, 8), time_scale=0)
+>>> asyncio.run(Station([small]).run([(0, big), (0, images[0])]))
+[Result(job=0, device=0, attempts=0, pages=0, error='Image of 421 bytes larger than the EEPROM (128 bytes)'), Result(job=1, device=0, attempts=1, pages=4, error=None)]
+>>> narrow = SimulatedDevice(SimulatedEEPROM(1024, 8, address_bytes=1), time_scale=0)
+>>> asyncio.run(Station([narrow], retries=2).run([(0, big), (0, images[0])]))
+[Result(job=0, device=0, attempts=1, pages=0, error="OverflowError('int too big to convert')"), Result(job=1, device=0, attempts=1, pages=4, error=None)]
+"""
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import errno
+import random
+import sys
+import time
+
+import tofe_diff
+from tofe_eeprom import TOFEAtoms
+
+Result = collections.namedtuple("Result", "job device attempts pages error")
+
+
+class SimulatedDevice(object):
+    """Async front end to a tofe_i2c.SimulatedEEPROM.
+
+    Each operation sleeps for the simulated time it took multiplied by
+    time_scale, plus delay. error_rate is the chance of an operation
+    failing with a bus error.
+    """
+
+    def __init__(self, eeprom, time_scale=1.0, delay=0.0, error_rate=0.0, seed=None):
+        self.eeprom = eeprom
+        self.time_scale = time_scale
+        self.delay = delay
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+
+    @property
+    def size(self):
+        return self.eeprom.size
+
+    @property
+    def page_size(self):
+        return self.eeprom.page_size
+
+    async def _run(self, f, *args):
+        if self.error_rate and self._random.random() < self.error_rate:
+            await asyncio.sleep(0)
+            raise OSError(errno.EREMOTEIO, "Simulated bus error")
+        start = self.eeprom.elapsed
+        r = f(*args)
+        await asyncio.sleep((self.eeprom.elapsed - start) * self.time_scale + self.delay)
+        return r
+
+    async def read(self, offset, n):
+        return await self._run(self.eeprom.read, offset, n)
+
+    async def write_page(self, offset, data):
+        return await self._run(self.eeprom.write_page, offset, data)
+
+
+class ThreadedDevice(object):
+    """Async front end to a blocking tofe_i2c.EEPROM, run in its own thread."""
+
+    def __init__(self, eeprom):
+        self.eeprom = eeprom
+        self._executor = concurrent.futures.ThreadPoolExecutor(1)
+
+    @property
+    def size(self):
+        return self.eeprom.size
+
+    @property
+    def page_size(self):
+        return self.eeprom.page_size
+
+    async def _run(self, f, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, f, *args)
+
+    async def read(self, offset, n):
+        return await self._run(self.eeprom.read, offset, n)
+
+    async def write_page(self, offset, data):
+        return await self._run(self.eeprom.write_page, offset, data)
+
+
+async def program(device, image, cls=TOFEAtoms):
+    """Write image to device, then read it back and check it.
+
+    Returns the number of pages written.
+    """
+    current = await device.read(0, len(image))
+    writes = tofe_diff.plan(current, image, device.page_size)
+    for w in writes:
+        await device.write_page(w.offset, w.data)
+    readback = await device.read(0, len(image))
+    if readback != image:
+        raise IOError("Verify failed")
+    cls.from_buffer(readback)
+    return len(writes)
+
+
+class Station(object):
+
+    def __init__(self, devices, retries=2, timeout=5.0, cls=TOFEAtoms):
+        self.devices = list(devices)
+        self.retries = retries
+        self.timeout = timeout
+        self.cls = cls
+
+    async def _worker(self, i, queue, results):
+        device = self.devices[i]
+        while True:
+            job, image = await queue.get()
+            try:
+                attempts = 0
+                pages = 0
+                error = None
+                while attempts <= self.retries:
+                    attempts += 1
+                    try:
+                        pages = await asyncio.wait_for(
+                            program(device, image, self.cls), self.timeout)
+                    except (OSError, asyncio.TimeoutError) as e:
+                        error = repr(e)
+                        continue
+                    except Exception as e:
+                        # A bug or a bad image fails the same way every time,
+                        # and letting it end the worker would leave run()
+                        # waiting for its queue forever.
+                        error = repr(e)
+                        break
+                    error = None
+                    break
+                results[job] = Result(job, i, attempts, pages, error)
+            finally:
+                queue.task_done()
+
+    async def run(self, jobs):
+        """Program (device index, image) jobs, returning a Result for each
+        in order."""
+        queues = [asyncio.Queue() for d in self.devices]
+        jobs = list(jobs)
+        results = [None] * len(jobs)
+        for job, (i, image) in enumerate(jobs):
+            image = tofe_diff._bytes(image)
+            if len(image) > self.devices[i].size:
+                error = "Image of %i bytes larger than the EEPROM (%i bytes)" % (
+                    len(image), self.devices[i].size)
+                results[job] = Result(job, i, 0, 0, error)
+                continue
+            queues[i].put_nowait((job, image))
+        workers = [asyncio.ensure_future(self._worker(i, q, results))
+                   for i, q in enumerate(queues)]
+        try:
+            for q in queues:
+                await q.join()
+        finally:
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("images", nargs="+", help="images to program, in turn on each device")
+    parser.add_argument("--bus", type=int, action="append", default=[],
+                        help="I2C adapter with an EEPROM, can be repeated")
+    parser.add_argument("--simulate", type=int, metavar="N",
+                        help="program N simulated devices instead")
+    parser.add_argument("--address", type=lambda s: int(s, 0), default=0x50,
+                        help="device address (default 0x50)")
+    parser.add_argument("--size", type=int, default=128, help="EEPROM size in bytes")
+    parser.add_argument("--page-size", type=int, default=8, help="page size in bytes")
+    parser.add_argument("--address-bytes", type=int, default=1,
+                        help="memory address bytes (default %(default)s)")
+    parser.add_argument("--retries", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=5.0,
+                        help="seconds allowed for each attempt (default %(default)s)")
+    args = parser.parse_args(argv)
+    if args.size > 256 ** args.address_bytes:
+        parser.error("--size %i needs more than %i address bytes" % (args.size, args.address_bytes))
+
+    import tofe_i2c
+    if args.simulate:
+        devices = [SimulatedDevice(tofe_i2c.SimulatedEEPROM(
+            args.size, args.page_size, args.address_bytes)) for i in range(0, args.simulate)]
+    elif args.bus:
+        devices = [ThreadedDevice(tofe_i2c.LinuxEEPROM(
+            bus, args.address, args.size, args.page_size, args.address_bytes)) for bus in args.bus]
+    else:
+        parser.error("no devices, use --bus or --simulate")
+
+    jobs = []
+    for n, filename in enumerate(args.images):
+        with open(filename, "rb") as f:
+            jobs.append((n % len(devices), f.read()))
+
+    station = Station(devices, args.retries, args.timeout)
+    start = time.monotonic()
+    results = asyncio.run(station.run(jobs))
+    elapsed = time.monotonic() - start
+
+    failed = 0
+    for r in results:
+        if r.error:
+            failed += 1
+        print("%s: device %i, %i attempts, %i pages%s" % (
+            args.images[r.job], r.device, r.attempts, r.pages,
+            ", failed: " + r.error if r.error else ""))
+    print("%i images in %.2fs, %i failed" % (len(results), elapsed, failed), file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
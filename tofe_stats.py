@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set ts=4 sw=4 et sts=4 ai:
+
+"""
+Count calls, bytes and time spent in the tofe_eeprom hot paths.
+
+enable() replaces the instrumented functions with counting versions and
+disable() puts the originals back, so there is no cost at all while
+disabled. Instrumented are:
+
+  crc8            every CRC (tofe_crc8.crc8), bytes hashed
+  crc_calculate   full CRC recalculations, bytes hashed
+  len             length changes, bytes grown and resize events
+  add_atom        bytes of the atoms added
+  get_atom
+  as_bytearray    bytes copied
+
+Times are inclusive, add_atom's includes the crc8 calls it makes.
+Counters are plain integers updated without a lock, so counts from
+threads running at once can be slightly low.
+
+  ./tofe_stats.py boards/*.json
+  ./tofe_stats.py boards/*.json --json
+
+>>> from tofe_eeprom import *
+>>> original = DynamicLengthStructure.crc_calculate
+>>> enable()
+>>> t = TOFEAtoms()
+>>> for i in range(0, 3):
+...     t.add_atom(AtomComment.create("Thanks for backing!"))
+>>> t.crc_check()
+True
+>>> disable()
+>>> s = snapshot()
+>>> s["add_atom"]["calls"], s["add_atom"]["bytes"], s["get_atom"]["calls"]
+(3, 63, 0)
+>>> s["crc_calculate"]["calls"], s["crc_calculate"]["bytes"]
+(3, 111)
+>>> s["len"]["calls"], s["len"]["resizes"]
+(7, 7)
+>>> s["add_atom"]["seconds"] > 0
+True
+>>> print("\\n".join(prometheus().splitlines()[:8]))
+# HELP tofe_eeprom_calls_total Calls of instrumented tofe_eeprom functions.
+# TYPE tofe_eeprom_calls_total counter
+tofe_eeprom_calls_total{function="crc8"} 19
+tofe_eeprom_calls_total{function="crc_calculate"} 3
+tofe_eeprom_calls_total{function="len"} 7
+tofe_eeprom_calls_total{function="add_atom"} 3
+tofe_eeprom_calls_total{function="get_atom"} 0
+tofe_eeprom_calls_total{function="as_bytearray"} 0
+
+Disabled, the original functions are back in place:
+
+>>> DynamicLengthStructure.crc_calculate is original
+True
+>>> reset()
+>>> t.add_atom(AtomComment.create("Thanks for backing!"))
+>>> snapshot()["add_atom"]["calls"]
+0
+>>> enable()
+>>> t.add_atom(AtomComment.create("Thanks for backing!"))
+>>> disable()
+>>> snapshot()["add_atom"]["calls"]
+1
+"""
+
+import argparse
+import ctypes
+import json
+import sys
+import time
+
+import tofe_crc8
+from tofe_eeprom import AtomsCommon, DynamicLengthStructure
+
+# Prometheus metric -> (field, help), in output order
+METRICS = [
+    ("tofe_eeprom_calls_total", "calls", "Calls of instrumented tofe_eeprom functions."),
+    ("tofe_eeprom_bytes_total", "bytes", "Bytes hashed, copied or grown by tofe_eeprom functions."),
+    ("tofe_eeprom_resizes_total", "resizes", "Resizes of tofe_eeprom structure buffers."),
+    ("tofe_eeprom_seconds_total", "seconds", "Time spent in tofe_eeprom functions (inclusive)."),
+]
+
+FUNCTIONS = ["crc8", "crc_calculate", "len", "add_atom", "get_atom", "as_bytearray"]
+
+_stats = {}
+_ORIGINALS = {}
+
+
+def reset():
+    """Zero all the counters."""
+    # In place, the installed wrappers hold on to these dicts.
+    for name in FUNCTIONS:
+        _stats.setdefault(name, {}).update(calls=0, bytes=0, resizes=0, seconds=0.0)
+
+reset()
+
+
+def _crc8(crc8):
+    s = _stats["crc8"]
+    def wrapper(data, crc=0):
+        start = time.perf_counter()
+        try:
+            return crc8(data, crc)
+        finally:
+            s["seconds"] += time.perf_counter() - start
+            s["calls"] += 1
+            s["bytes"] += len(data)
+    return wrapper
+
+
+def _crc_calculate(crc_calculate):
+    s = _stats["crc_calculate"]
+    def wrapper(self):
+        start = time.perf_counter()
+        try:
+            return crc_calculate(self)
+        finally:
+            s["seconds"] += time.perf_counter() - start
+            s["calls"] += 1
+            s["bytes"] += self._size - 1
+    return wrapper
+
+
+def _len(prop):
+    s = _stats["len"]
+    fset = prop.fset
+    def wrapper(self, value):
+        before = ctypes.sizeof(self)
+        start = time.perf_counter()
+        try:
+            fset(self, value)
+        finally:
+            s["seconds"] += time.perf_counter() - start
+            s["calls"] += 1
+            after = ctypes.sizeof(self)
+            if after != before:
+                s["resizes"] += 1
+                s["bytes"] += after - before
+    return property(prop.fget, wrapper, prop.fdel, prop.__doc__)
+
+
+def _add_atom(add_atom):
+    s = _stats["add_atom"]
+    def wrapper(self, atom):
+        start = time.perf_counter()
+        try:
+            return add_atom(self, atom)
+        finally:
+            s["seconds"] += time.perf_counter() - start
+            s["calls"] += 1
+            s["bytes"] += atom._size
+    return wrapper
+
+
+def _get_atom(get_atom):
+    s = _stats["get_atom"]
+    def wrapper(self, v):
+        start = time.perf_counter()
+        try:
+            return get_atom(self, v)
+        finally:
+            s["seconds"] += time.perf_counter() - start
+            s["calls"] += 1
+    return wrapper
+
+
+def _as_bytearray(as_bytearray):
+    s = _stats["as_bytearray"]
+    def wrapper(self):
+        start = time.perf_counter()
+        b = as_bytearray(self)
+        s["seconds"] += time.perf_counter() - start
+        s["calls"] += 1
+        s["bytes"] += len(b)
+        return b
+    return wrapper
+
+
+# name -> (object, attribute, wrap)
+_HOOKS = {
+    "crc8":             (tofe_crc8, "crc8", _crc8),
+    "crc_calculate":    (DynamicLengthStructure, "crc_calculate", _crc_calculate),
+    "len":              (DynamicLengthStructure, "len", _len),
+    "add_atom":         (AtomsCommon, "add_atom", _add_atom),
+    "get_atom":         (AtomsCommon, "get_atom", _get_atom),
+    "as_bytearray":     (DynamicLengthStructure, "as_bytearray", _as_bytearray),
+}
+
+
+def enabled():
+    return bool(_ORIGINALS)
+
+
+def enable():
+    """Install the instrumented functions."""
+    if enabled():
+        return
+    # crc8 replaces itself on its first call, make that happen first.
+    tofe_crc8.crc8(b"")
+    for name, (obj, attr, wrap) in _HOOKS.items():
+        original = obj.__dict__[attr]
+        _ORIGINALS[name] = original
+        setattr(obj, attr, wrap(original))
+
+
+def disable():
+    """Put back the original functions, the counters are kept."""
+    for name, original in _ORIGINALS.items():
+        obj, attr, wrap = _HOOKS[name]
+        setattr(obj, attr, original)
+    _ORIGINALS.clear()
+
+
+def snapshot():
+    """Copy of the counters, {function: {calls, bytes, resizes, seconds}}."""
+    return {name: dict(_stats[name]) for name in FUNCTIONS}
+
+
+def prometheus(stats=None):
+    """The counters in the Prometheus text exposition format."""
+    if stats is None:
+        stats = snapshot()
+    lines = []
+    for metric, field, help in METRICS:
+        lines.append("# HELP %s %s" % (metric, help))
+        lines.append("# TYPE %s counter" % metric)
+        for name in FUNCTIONS:
+            if field == "resizes" and name != "len":
+                continue
+            lines.append('%s{function="%s"} %s' % (metric, name, stats[name][field]))
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("boards", nargs="+", help="board descriptions (JSON) to build")
+    parser.add_argument("--repeat", type=int, default=100,
+                        help="times to build and check each board (default %(default)s)")
+    parser.add_argument("--json", action="store_true", help="print the counters as JSON")
+    args = parser.parse_args(argv)
+
+    import tofe_board
+    from tofe_eeprom import TOFEAtoms
+
+    boards = [tofe_board.load(filename) for filename in args.boards]
+    enable()
+    try:
+        for i in range(0, args.repeat):
+            for board in boards:
+                t = TOFEAtoms.from_buffer(tofe_board.build(board))
+                repr(t)
+                t.crc_check()
+    finally:
+        disable()
+
+    if args.json:
+        print(json.dumps(snapshot(), indent=2, sort_keys=True))
+    else:
+        sys.stdout.write(prometheus())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())